@@ -0,0 +1,131 @@
+from collections import OrderedDict
+import threading
+
+from compression import compress
+from storage import read_range
+
+# Memória máxima (em bytes) usada pelo cache de chunks servidos
+CHUNK_CACHE_BYTES = 64 * 1024 * 1024
+# Chunks pedidos uma única vez recentemente que o cache lembra (apenas a localização)
+CACHE_CANDIDATES = 4096
+
+class ChunkCache:
+    """
+    Cache LRU, limitado em bytes, dos chunks servidos recentemente.
+    As entradas são indexadas pela localização do chunk (caminho, offset, tamanho) e pela
+    compressão, e guardam os bytes exatamente como são enviados: assim, um chunk popular não
+    é lido do disco nem comprimido novamente a cada pedido. Quando o total passa de
+    `max_bytes`, as entradas usadas há mais tempo são descartadas.
+    Um chunk só entra no cache a partir do segundo pedido entre os `candidates` pedidos
+    recentes: o primeiro é servido do disco (com sendfile, se não houver compressão), e um
+    download sequencial que pede cada chunk uma vez não tira do cache os chunks populares.
+    """
+    def __init__(self, max_bytes=CHUNK_CACHE_BYTES, candidates=CACHE_CANDIDATES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        # Localizações pedidas uma vez, na ordem do pedido
+        self.candidates = OrderedDict()
+        self.max_candidates = candidates
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.evicted_bytes = 0
+        self.lock = threading.Lock()
+
+    def admits(self, length):
+        """ Indica se um chunk desse tamanho pode ser guardado (cada um usa no máximo 1/4 do cache) """
+        return 0 < length <= self.max_bytes // 4
+
+    def get(self, location, encoding=None):
+        key = (location, encoding)
+        with self.lock:
+            data = self.entries.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def put(self, location, data, encoding=None):
+        if not self.admits(len(data)):
+            return
+        key = (location, encoding)
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous)
+            self.entries[key] = data
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+                self.evictions += 1
+                self.evicted_bytes += len(evicted)
+
+    def admit(self, location):
+        """ Registra o pedido de um chunk fora do cache; retorna True se ele já foi pedido recentemente """
+        if not self.admits(location[2]):
+            return False
+        with self.lock:
+            if self.candidates.pop(location, None) is not None:
+                return True
+            self.candidates[location] = True
+            if len(self.candidates) > self.max_candidates:
+                self.candidates.popitem(last=False)
+            return False
+
+    def payload(self, location, encoding=None):
+        """
+        Bytes do chunk em `location`, comprimidos com `encoding`, a partir do cache; um chunk
+        pedido pela segunda vez é lido do disco e guardado. Retorna None se o chunk ainda não deve
+        entrar no cache: o chamador o lê do disco.
+        """
+        data = self.get(location, encoding)
+        if data is not None:
+            return data
+        if not self.admit(location):
+            return None
+        if encoding is None:
+            data = read_range(*location)
+            self.put(location, data)
+            return data
+        # Só a cópia comprimida é guardada; a original é aproveitada se já estiver no cache,
+        # sem contar outro acerto ou falha nem mexer na ordem do LRU: o pedido é um só
+        with self.lock:
+            raw = self.entries.get((location, None))
+        if raw is None:
+            raw = read_range(*location)
+        data = compress(encoding, raw)
+        self.put(location, data, encoding)
+        return data
+
+    def _discard_matching(self, match):
+        with self.lock:
+            for key in [key for key in self.entries if match(key[0])]:
+                self.size -= len(self.entries.pop(key))
+            for location in [location for location in self.candidates if match(location)]:
+                del self.candidates[location]
+
+    def discard(self, location):
+        """ Remove um chunk, em todas as compressões """
+        self._discard_matching(lambda entry: entry == location)
+
+    def discard_path(self, path):
+        """ Remove todas as entradas de um arquivo (ele deixou de ser oferecido ou foi alterado) """
+        self._discard_matching(lambda entry: entry[0] == path)
+
+    def stats(self):
+        with self.lock:
+            requests = self.hits + self.misses
+            return {
+                "bytes": self.size,
+                "max_bytes": self.max_bytes,
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / requests if requests else 0.0,
+                "evictions": self.evictions,
+                "evicted_bytes": self.evicted_bytes,
+            }
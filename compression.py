@@ -0,0 +1,86 @@
+import zlib
+import lzma
+import os
+
+# Nível de compressão do zlib (1 = mais rápido, 9 = menor); o nível 1 já reduz bem texto
+# sem fazer da compressão o gargalo em redes rápidas
+ZLIB_LEVEL = 1
+# Preset do lzma (0 = mais rápido, 9 = menor); mais lento que o zlib, mas comprime mais
+LZMA_PRESET = 1
+# Compressões aceitas nos downloads, em ordem de preferência (vazio = sem compressão).
+# Desligada por padrão: em redes rápidas o envio zero-copy dos dados originais é mais rápido;
+# use ("zlib",) em links lentos
+ACCEPT_ENCODINGS = ()
+# Bytes do início de cada chunk comprimidos para estimar se a compressão compensa
+COMPRESSION_SAMPLE = 16 * 1024
+# Tamanho máximo da amostra comprimida, em fração da original, para o chunk ser comprimido
+MAX_COMPRESSED_RATIO = 0.9
+
+# nome -> (comprimir(dados), novo descompressor incremental)
+ENCODINGS = {
+    "zlib": (lambda data: zlib.compress(data, ZLIB_LEVEL), zlib.decompressobj),
+    "lzma": (lambda data: lzma.compress(data, preset=LZMA_PRESET), lzma.LZMADecompressor),
+}
+
+def choose_encoding(accepted):
+    """ Escolhe a primeira compressão aceita pelo cliente que este peer conhece (None = sem compressão) """
+    for encoding in accepted or ():
+        if encoding in ENCODINGS:
+            return encoding
+    return None
+
+def compress(encoding, data):
+    if encoding is None:
+        return data
+    return ENCODINGS[encoding][0](data)
+
+def range_encoding(encoding, path, offset, length):
+    """
+    Compressão a usar para `length` bytes de `path` a partir de `offset`: `encoding` só se uma
+    amostra do início do trecho encolher o bastante; senão None, e o trecho vai sem compressão.
+    """
+    if encoding is None:
+        return None
+    with open(path, "rb") as f:
+        if hasattr(os, "pread"):
+            sample = os.pread(f.fileno(), min(length, COMPRESSION_SAMPLE), offset)
+        else:
+            f.seek(offset)
+            sample = f.read(min(length, COMPRESSION_SAMPLE))
+    if sample and len(compress(encoding, sample)) <= len(sample) * MAX_COMPRESSED_RATIO:
+        return encoding
+    return None
+
+class StreamDecompressor:
+    """
+    Descomprime um chunk recebido bloco a bloco, sem juntar o payload inteiro na memória.
+    `length` é o tamanho original informado pelo peer: a saída é limitada a ele, e um tamanho
+    diferente é tratado como erro de transferência. Sem compressão, os blocos passam inalterados.
+    """
+    def __init__(self, encoding, length):
+        if encoding is not None and encoding not in ENCODINGS:
+            raise IOError(f"Compressão desconhecida: {encoding}")
+        self.encoding = encoding
+        self.decompressor = ENCODINGS[encoding][1]() if encoding is not None else None
+        self.remaining = length
+
+    def feed(self, payload):
+        """ Retorna os dados originais correspondentes a mais um bloco recebido """
+        if self.decompressor is None:
+            data = payload
+        else:
+            try:
+                data = self.decompressor.decompress(payload, self.remaining + 1)
+            except (zlib.error, lzma.LZMAError) as e:
+                raise IOError(f"Erro ao descomprimir ({self.encoding}): {e}")
+        if len(data) > self.remaining:
+            raise IOError("Tamanho do chunk descomprimido não confere.")
+        self.remaining -= len(data)
+        return data
+
+    def finish(self):
+        """ Confere, depois do último bloco, que o chunk foi recebido por completo """
+        if self.decompressor is not None and not self.decompressor.eof:
+            raise IOError(f"Dados comprimidos ({self.encoding}) incompletos.")
+        if self.remaining:
+            raise IOError("Tamanho do chunk descomprimido não confere.")
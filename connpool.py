@@ -0,0 +1,249 @@
+from xmlrpc.server import SimpleXMLRPCServer, SimpleXMLRPCRequestHandler
+import xmlrpc.client
+import socketserver
+import threading
+import select
+import time
+
+# Máximo de conexões abertas (em uso + ociosas) com um mesmo endereço
+MAX_PER_HOST = 16
+# Tempo (em segundos) após o qual uma conexão ociosa do pool é fechada
+IDLE_TIMEOUT = 10
+# Tempo máximo (em segundos) de espera por uma conexão quando o limite por endereço foi atingido
+ACQUIRE_TIMEOUT = 30
+# Tempo limite (em segundos) das chamadas XML-RPC
+RPC_TIMEOUT = 30
+# Tempo (em segundos) que o servidor mantém aberta uma conexão XML-RPC ociosa;
+# deve ser maior que IDLE_TIMEOUT para que o cliente feche a conexão antes do servidor
+KEEPALIVE_TIMEOUT = 15
+# Intervalo (em segundos) em que o servidor reavalia as conexões ociosas
+POLL_INTERVAL = 0.5
+
+def socket_alive(sock):
+    """
+    Verifica se uma conexão ociosa ainda pode ser usada: um socket ocioso que está pronto
+    para leitura foi fechado pelo outro lado (ou recebeu dados inesperados).
+    """
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+    except (OSError, ValueError):
+        return False
+    return not readable
+
+class ConnectionPool:
+    """
+    Pool de conexões persistentes, seguro entre threads, indexado pelo endereço de destino.
+    Cada conexão é usada por uma thread de cada vez e devolvida ao pool ao final da requisição.
+    `connect(endereço)` cria uma conexão, que deve oferecer is_alive() e close().
+    Conexões ociosas há mais de `idle_timeout` segundos são fechadas, e as demais passam por
+    uma verificação de saúde antes de serem reutilizadas. No máximo `max_per_host` conexões
+    ficam abertas por endereço; acima disso, acquire() aguarda uma conexão ser devolvida.
+    """
+    def __init__(self, connect, max_per_host=MAX_PER_HOST, idle_timeout=IDLE_TIMEOUT,
+                 acquire_timeout=ACQUIRE_TIMEOUT):
+        self.connect = connect
+        self.max_per_host = max_per_host
+        self.idle_timeout = idle_timeout
+        self.acquire_timeout = acquire_timeout
+        # endereço -> [(instante da devolução, conexão)], da mais antiga para a mais recente
+        self.idle = {}
+        # endereço -> número de conexões abertas (em uso + ociosas)
+        self.open = {}
+        self.last_sweep = 0
+        self.lock = threading.Lock()
+        self.available = threading.Condition(self.lock)
+
+    def _forget(self, key):
+        """ Desconta uma conexão fechada do limite do endereço (requer lock) """
+        self.open[key] -= 1
+        if not self.open[key]:
+            del self.open[key]
+        self.available.notify()
+
+    def _evict_idle(self):
+        """ Fecha as conexões ociosas há mais de idle_timeout segundos (requer lock) """
+        now = time.time()
+        if now - self.last_sweep < 1:
+            return
+        self.last_sweep = now
+        for key in list(self.idle):
+            connections = self.idle[key]
+            while connections and now - connections[0][0] >= self.idle_timeout:
+                _, conn = connections.pop(0)
+                conn.close()
+                self._forget(key)
+            if not connections:
+                del self.idle[key]
+
+    def acquire(self, key):
+        """ Retorna uma conexão com `key`, reutilizando uma ociosa quando possível """
+        deadline = time.time() + self.acquire_timeout
+        with self.available:
+            self._evict_idle()
+            while True:
+                connections = self.idle.get(key)
+                while connections:
+                    # A conexão usada mais recentemente é a que tem menos chance de ter expirado
+                    last_used, conn = connections.pop()
+                    if time.time() - last_used < self.idle_timeout and conn.is_alive():
+                        return conn
+                    conn.close()
+                    self._forget(key)
+                if self.open.get(key, 0) < self.max_per_host:
+                    self.open[key] = self.open.get(key, 0) + 1
+                    break
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise IOError(f"Limite de {self.max_per_host} conexões com {key} atingido.")
+                self.available.wait(remaining)
+        try:
+            return self.connect(key)
+        except BaseException:
+            with self.available:
+                self._forget(key)
+            raise
+
+    def release(self, key, conn):
+        """ Devolve ao pool uma conexão que terminou a requisição sem erros """
+        with self.available:
+            self.idle.setdefault(key, []).append((time.time(), conn))
+            self.available.notify()
+
+    def discard(self, key, conn):
+        """ Fecha uma conexão que falhou ou ficou em estado indefinido """
+        conn.close()
+        with self.available:
+            self._forget(key)
+
+    def connection(self, key):
+        return PooledConnection(self, key)
+
+    def close_all(self):
+        """ Fecha todas as conexões ociosas """
+        with self.available:
+            for key, connections in self.idle.items():
+                for _, conn in connections:
+                    conn.close()
+                    self._forget(key)
+            self.idle = {}
+
+class PooledConnection:
+    """
+    Empresta uma conexão do pool em um bloco `with`: ela volta ao pool se o bloco terminar
+    normalmente e é descartada se ocorrer uma exceção.
+    """
+    def __init__(self, pool, key):
+        self.pool = pool
+        self.key = key
+        self.conn = None
+
+    def __enter__(self):
+        self.conn = self.pool.acquire(self.key)
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.pool.release(self.key, self.conn)
+        else:
+            self.pool.discard(self.key, self.conn)
+        return False
+
+# -------------------------
+# XML-RPC COM CONEXÕES PERSISTENTES
+# -------------------------
+class KeepAliveTransport(xmlrpc.client.Transport):
+    """ Transporte XML-RPC que mantém a conexão HTTP/1.1 aberta entre as chamadas """
+    def __init__(self, timeout=RPC_TIMEOUT):
+        super().__init__()
+        self.timeout = timeout
+
+    def make_connection(self, host):
+        connection = super().make_connection(host)
+        connection.timeout = self.timeout
+        return connection
+
+    def is_alive(self):
+        connection = self._connection[1]
+        if connection is None or connection.sock is None:
+            # Ainda não conectado: a conexão será aberta na próxima chamada
+            return True
+        return socket_alive(connection.sock)
+
+# Pool de transportes XML-RPC do processo, indexado pelo endereço (URL) do servidor
+rpc_pool = ConnectionPool(lambda address: KeepAliveTransport())
+
+class PooledServerProxy:
+    """
+    Substituto de xmlrpc.client.ServerProxy que pode ser compartilhado entre threads:
+    cada chamada usa um transporte persistente emprestado de `rpc_pool`.
+    """
+    def __init__(self, address, pool=None):
+        self.address = address
+        self.pool = pool if pool is not None else rpc_pool
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return lambda *args: self._call(name, args)
+
+    def _call(self, name, args):
+        transport = self.pool.acquire(self.address)
+        try:
+            proxy = xmlrpc.client.ServerProxy(self.address, transport=transport, allow_none=True)
+            result = getattr(proxy, name)(*args)
+        except xmlrpc.client.Fault:
+            # Erro do método remoto: a conexão continua íntegra
+            self.pool.release(self.address, transport)
+            raise
+        except BaseException:
+            self.pool.discard(self.address, transport)
+            raise
+        self.pool.release(self.address, transport)
+        return result
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+class KeepAliveRequestHandler(SimpleXMLRPCRequestHandler):
+    """
+    Atende várias requisições XML-RPC na mesma conexão (HTTP/1.1 keep-alive).
+    A conexão ociosa é encerrada após KEEPALIVE_TIMEOUT segundos, ou antes disso se o
+    servidor indicar, por saturated(), que há conexões esperando por uma thread livre.
+    """
+    protocol_version = "HTTP/1.1"
+
+    def handle(self):
+        self.close_connection = True
+        self.handle_one_request()
+        while not self.close_connection and self.wait_for_request():
+            self.handle_one_request()
+
+    def wait_for_request(self):
+        """ Aguarda a próxima requisição; retorna False se a conexão deve ser encerrada """
+        # O cliente XML-RPC só envia a próxima requisição após receber a resposta,
+        # então não há dados pendentes no buffer de leitura
+        saturated = getattr(self.server, "saturated", None)
+        deadline = time.time() + KEEPALIVE_TIMEOUT
+        while True:
+            if saturated is not None and saturated():
+                return False
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            try:
+                readable, _, _ = select.select([self.connection], [], [], min(POLL_INTERVAL, remaining))
+            except (OSError, ValueError):
+                return False
+            if readable:
+                return True
+
+class ThreadedXMLRPCServer(socketserver.ThreadingMixIn, SimpleXMLRPCServer):
+    """ Servidor XML-RPC dos peers: uma thread por conexão persistente """
+    daemon_threads = True
+
+    def __init__(self, addr, **kwargs):
+        kwargs.setdefault("requestHandler", KeepAliveRequestHandler)
+        super().__init__(addr, **kwargs)
@@ -0,0 +1,186 @@
+import asyncio
+import os
+
+from tracker_client import SourceRefresher
+from storage import open_download, reuse_local_chunks
+from scheduler import PieceScheduler, ConcurrencyController
+from hashing import file_checksum, DEFAULT_CHUNK_SIZE
+from engine import DownloadEngine
+from manifest import file_signature
+
+def plan_checksums(chunks):
+    """
+    Confere os chunks de um plano de download e retorna os checksums indexados pelo chunk_id.
+    Lança ValueError se o plano não tiver chunks ou se algum chunk não tiver um chunk_id válido
+    (inteiro não negativo, sem repetição): sem ele, não há como posicionar o chunk no arquivo.
+    """
+    if not chunks:
+        raise ValueError("o plano não tem chunks")
+    ids = [c.get("chunk_id") for c in chunks]
+    if not all(isinstance(chunk_id, int) and not isinstance(chunk_id, bool) and chunk_id >= 0 for chunk_id in ids):
+        raise ValueError("há chunks sem chunk_id")
+    if len(set(ids)) != len(ids):
+        raise ValueError("há chunk_ids repetidos")
+    checksums = [None] * (max(ids) + 1)
+    for c in chunks:
+        checksums[c["chunk_id"]] = c["checksum"]
+    return checksums
+
+class FileDownloader:
+    """
+    Download de arquivos, comum a peer.py e peerall.py:
+      - O plano de download (checksum, chunks, peers e endereços) é obtido do tracker em uma única
+        chamada e conferido antes de qualquer alteração no disco.
+      - Os chunks são baixados do mais raro para o mais comum, cada um do peer com menos
+        requisições pendentes e maior vazão observada; dentro do limite de conexões, o número de
+        requisições simultâneas a cada peer é ajustado por AIMD. No fim do download (endgame),
+        chunks lentos também são pedidos a outros peers e chunks que falharam são pedidos novamente.
+        Enquanto o download ocorre, as fontes são atualizadas com as mudanças informadas pelo
+        tracker (SourceRefresher), e seeders que surgirem no meio do download também são usados.
+      - O arquivo de destino é pré-alocado e os chunks são baixados em paralelo pelo motor
+        asyncio (DownloadEngine), verificados e gravados diretamente na sua posição. Assim que
+        um chunk é baixado com sucesso, ele é marcado no estado persistente do download e
+        enfileirado no announcer, que o registra no tracker em lote para que este peer passe a
+        ser seeder daquele chunk.
+      - Se o download for interrompido, o próximo download do mesmo arquivo baixa apenas os
+        chunks que ainda faltam ou que não passaram na verificação.
+      - Chunks cujo conteúdo (checksum) este peer já possui em outro arquivo ou versão são
+        copiados localmente, sem download; os demais são pedidos pelo conteúdo, e por isso
+        podem vir de qualquer peer que tenha o mesmo chunk.
+      - Ao final, o checksum do arquivo é verificado e, se conferir, o arquivo é apenas renomeado
+        (substituindo uma versão local diferente) e todos os chunks são registrados novamente.
+    `share_ranges` e `local_file_checksum` são as funções do peer que oferecem os chunks de um
+    arquivo e calculam o checksum de um arquivo local.
+    """
+    def __init__(self, proxy, peer_name, announcer, chunk_table, share_manifest, share_ranges,
+                 local_file_checksum, hash_workers=1):
+        self.proxy = proxy
+        self.peer_name = peer_name
+        self.announcer = announcer
+        self.chunk_table = chunk_table
+        self.share_manifest = share_manifest
+        self.share_ranges = share_ranges
+        self.local_file_checksum = local_file_checksum
+        self.hash_workers = hash_workers
+
+    def load_plan(self, file_name):
+        """ Obtém e confere o plano de download de um arquivo; retorna None (e informa o motivo) se ele não servir """
+        plan = self.proxy.get_download_plan(file_name)
+        if not plan["chunks"]:
+            print(f"Nenhum chunk encontrado para o arquivo '{file_name}'.")
+            return None
+        if plan["checksum"] == "Checksum não encontrado.":
+            print(f"Checksum final do arquivo '{file_name}' não encontrado.")
+            return None
+        try:
+            plan_checksums(plan["chunks"])
+        except ValueError as e:
+            print(f"Plano de download inválido para o arquivo '{file_name}': {e}.")
+            return None
+        return plan
+
+    def download(self, plan, num_connections):
+        """ Baixa o arquivo do plano com até `num_connections` requisições; retorna True se ele foi baixado e verificado """
+        file_name = plan["file_name"]
+        chunks = plan["chunks"]
+        final_checksum = plan["checksum"]
+        addresses = plan["addresses"]
+        chunk_table = self.chunk_table
+        announcer = self.announcer
+
+        # O arquivo é pré-alocado com o tamanho máximo possível e truncado ao final.
+        # Um download interrompido do mesmo arquivo é retomado a partir do estado salvo.
+        checksums = plan_checksums(chunks)
+        # O tamanho de chunk é o escolhido por quem compartilhou o arquivo
+        chunk_size = plan["chunk_size"] or DEFAULT_CHUNK_SIZE
+        # Com chunks de tamanho variável, a posição de cada um vem do tracker
+        layout = None
+        if len(chunks) == len(checksums) and all(c["offset"] is not None for c in chunks):
+            layout = [(c["offset"], c["length"]) for c in chunks]
+        state, partial = open_download(file_name, final_checksum, chunk_size, checksums, layout)
+        resumed = [c for c in chunks if state.is_done(c["chunk_id"])]
+        if resumed:
+            print(f"Retomando download: {len(resumed)} de {len(checksums)} chunks já verificados.")
+        reused = reuse_local_chunks(chunk_table, state, partial)
+        if reused:
+            print(f"{len(reused)} chunk(s) copiados de arquivos locais com o mesmo conteúdo.")
+        available = [c for c in chunks if state.is_done(c["chunk_id"])]
+        if available:
+            for c in available:
+                c["offset"] = state.chunk_offset(c["chunk_id"])
+                c["length"] = state.chunk_length(c["chunk_id"])
+                chunk_table.add(c["chunk_name"], partial.path, c["offset"], c["length"], c["checksum"])
+            announcer.announce(file_name, [(c["chunk_id"], c["chunk_name"], c["checksum"], c["offset"], c["length"])
+                                           for c in available], final_checksum, chunk_size)
+        pending = [c for c in chunks if not state.is_done(c["chunk_id"])]
+        if pending and not any(peer != self.peer_name for c in pending for peer in c["peers"]):
+            print(f"Nenhum outro peer oferece os chunks que faltam do arquivo '{file_name}'.")
+            partial.close()
+            state.close()
+            return False
+
+        # Os chunks são entregues do mais raro para o mais comum, cada um ao peer menos carregado
+        scheduler = PieceScheduler(pending, self.peer_name, chunk_size, ConcurrencyController(num_connections))
+
+        def store_chunk(chunk_info, length):
+            # Assim que o chunk for baixado, marca-o no estado e passa a oferecê-lo a partir do arquivo parcial
+            chunk_id, chunk_name, checksum = chunk_info["chunk_id"], chunk_info["chunk_name"], chunk_info["checksum"]
+            offset = state.chunk_offset(chunk_id)
+            state.mark_done(chunk_id, length)
+            chunk_table.add(chunk_name, partial.path, offset, length, checksum)
+            announcer.announce(file_name, [(chunk_id, chunk_name, checksum, offset, length)], final_checksum,
+                               chunk_size)
+
+        print("Iniciando download dos chunks...")
+        # Todas as requisições são multiplexadas em um único event loop
+        engine = DownloadEngine(scheduler, addresses, partial, chunk_size, on_chunk=store_chunk,
+                                peer_name=self.peer_name)
+        # Durante o download, novas fontes são buscadas no tracker apenas pelas mudanças desde o plano
+        refresher = SourceRefresher(self.proxy, plan, scheduler, addresses).start()
+        try:
+            asyncio.run(engine.run())
+        except Exception as e:
+            print(f"Erro durante o download: {e}")
+        finally:
+            refresher.stop()
+        for chunk_id, error in scheduler.failed.items():
+            print(f"Falha ao baixar o chunk {chunk_id}: {error}.")
+
+        missing = [i for i in range(len(checksums)) if not state.is_done(i)]
+        if missing:
+            print(f"Download incompleto: {len(missing)} chunk(s) não foram baixados. "
+                  "Digite 'get' novamente para retomar.")
+            partial.close()
+            state.close()
+            return False
+        print("Todos os chunks foram baixados. Verificando o arquivo...")
+        partial.finish(state.file_size)
+        # Os chunks já foram verificados um a um; o novo registro mantém a divisão anunciada pelo tracker
+        downloaded_checksum = file_checksum(partial.path, workers=self.hash_workers)
+        ranges = [(i, state.chunk_offset(i), state.chunk_length(i), checksums[i]) for i in range(len(checksums))]
+        if downloaded_checksum != final_checksum:
+            print("O checksum do arquivo baixado não confere!")
+            chunk_table.remove_file(partial.path)
+            partial.discard()
+            state.remove()
+            return False
+        print("Arquivo baixado com sucesso e o checksum confere!")
+        # Os chunks deixam de ser servidos a partir do arquivo parcial
+        chunk_table.remove_file(partial.path)
+        if os.path.exists(file_name) and self.local_file_checksum(file_name) == final_checksum:
+            # O arquivo local já tem o mesmo conteúdo
+            partial.discard()
+        else:
+            # Renomeia o arquivo baixado para o nome original; uma versão local diferente é
+            # substituída, e os chunks anunciados a partir dela deixam de valer
+            chunk_table.remove_file(file_name)
+            partial.commit()
+            # O arquivo baixado entra no manifesto e não precisa ser relido na próxima inicialização
+            self.share_manifest.store(file_name, file_signature(file_name), final_checksum, chunk_size, ranges)
+            self.share_manifest.save()
+        state.remove()
+        # Registra novamente todos os chunks para garantir que o peer tem o arquivo completo
+        local_chunks = self.share_ranges(file_name, ranges)
+        announcer.announce(file_name, local_chunks, final_checksum, chunk_size)
+        announcer.flush()
+        return True
@@ -0,0 +1,271 @@
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import hashlib
+import time
+import os
+
+from connpool import PooledServerProxy, IDLE_TIMEOUT
+from transfer import TransferCancelled, RECV_BUFFER, DATA_TIMEOUT, get_data_address, parse_header, content_chunk_name
+from compression import ACCEPT_ENCODINGS, StreamDecompressor
+from storage import ChunkBuffer
+
+# Threads usadas para calcular os checksums e gravar os chunks no disco
+DISK_WORKERS = os.cpu_count() or 1
+# Bytes recebidos de um chunk que são acumulados antes de cada gravação no pool de threads
+WRITE_BUFFER = 256 * 1024
+
+class ChunkWriter:
+    """
+    Destino dos blocos recebidos de um chunk: cada bloco é descomprimido, entra no SHA-256
+    incremental e é gravado na sua posição de `output`, sem que o chunk inteiro fique em memória.
+    Os métodos são executados no pool de threads, um bloco de cada vez e na ordem de chegada.
+    """
+    def __init__(self, output, offset, encoding, length):
+        self.output = output
+        self.position = offset
+        self.decompressor = StreamDecompressor(encoding, length)
+        self.digest = hashlib.sha256()
+        self.length = 0
+
+    def write(self, payload):
+        data = self.decompressor.feed(payload)
+        if data:
+            self.digest.update(data)
+            self.output.write_at(self.position, data)
+            self.position += len(data)
+            self.length += len(data)
+
+    def finish(self, chunk):
+        """ Confere o tamanho e o checksum do chunk recebido; retorna o tamanho """
+        self.decompressor.finish()
+        if chunk["checksum"] and self.digest.hexdigest() != chunk["checksum"]:
+            raise IOError(f"Checksum do chunk '{chunk['chunk_name']}' não confere.")
+        return self.length
+
+class AsyncDataConnection:
+    """ Conexão assíncrona com o canal de dados de um peer """
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.last_used = time.time()
+
+    def is_alive(self):
+        return (time.time() - self.last_used < IDLE_TIMEOUT
+                and not self.reader.at_eof() and not self.writer.is_closing())
+
+    def close(self):
+        self.writer.close()
+
+class AsyncDataPool:
+    """
+    Conexões persistentes do canal de dados usadas pelo motor asyncio, por endereço (host, porta).
+    O número de conexões com cada peer já é limitado pela janela do escalonador.
+    """
+    def __init__(self, peer_name=None, encodings=ACCEPT_ENCODINGS):
+        self.peer_name = peer_name
+        self.encodings = encodings
+        self.idle = {}
+
+    async def acquire(self, data_address):
+        connections = self.idle.get(data_address)
+        while connections:
+            conn = connections.pop()
+            if conn.is_alive():
+                return conn
+            conn.close()
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(*data_address), DATA_TIMEOUT)
+        if self.peer_name:
+            # Identifica este peer para a fila justa e os limites de upload do outro lado
+            writer.write(f"PEER {self.peer_name}\n".encode("utf-8"))
+        if self.encodings:
+            # Negocia a compressão usada em todas as transferências desta conexão
+            writer.write(f"ACCEPT {','.join(self.encodings)}\n".encode("utf-8"))
+        return AsyncDataConnection(reader, writer)
+
+    def release(self, data_address, conn):
+        conn.last_used = time.time()
+        self.idle.setdefault(data_address, []).append(conn)
+
+    def close_all(self):
+        for connections in self.idle.values():
+            for conn in connections:
+                conn.close()
+        self.idle = {}
+
+class DownloadEngine:
+    """
+    Motor de download assíncrono: uma única thread com um event loop asyncio multiplexa todas
+    as requisições de chunks, em vez de uma thread por conexão.
+    As requisições vêm do `scheduler` (PieceScheduler), que decide o chunk, o peer e quantas
+    requisições simultâneas cada peer recebe. Os bytes recebidos pelo canal de dados são
+    gravados em blocos direto no arquivo parcial (`partial`), com checksum incremental; a
+    descompressão, o checksum e a gravação rodam em um pool de threads, para não bloquear o
+    event loop. Requisições duplicadas (endgame) são recebidas em memória e só gravadas se
+    chegarem primeiro.
+    Chunks com checksum conhecido são pedidos pelo conteúdo ("sha256:<checksum>"), o que permite
+    baixá-los de peers que possuem o mesmo conteúdo em outro arquivo; cada chunk é gravado em
+    chunk["offset"], ou em chunk_id * chunk_size quando o offset não é informado.
+    `on_chunk(chunk, tamanho)` é chamado (no pool de threads) para cada chunk concluído e verificado.
+    `peer_name` identifica este peer para os seeders; `encodings` são as compressões aceitas,
+    em ordem de preferência.
+    Uso: asyncio.run(DownloadEngine(...).run()).
+    """
+    def __init__(self, scheduler, addresses, partial, chunk_size, on_chunk=None, executor=None, peer_name=None,
+                 encodings=ACCEPT_ENCODINGS):
+        self.scheduler = scheduler
+        self.addresses = addresses
+        self.partial = partial
+        self.chunk_size = chunk_size
+        self.on_chunk = on_chunk
+        self.executor = executor
+        self.peer_name = peer_name
+        self.encodings = encodings
+        self.pool = None
+        # Futuros dos workers ociosos, resolvidos por _notify
+        self.waiters = []
+
+    async def run(self):
+        """ Baixa todos os chunks do escalonador; retorna os chunks que falharam ({chunk_id: erro}) """
+        own_executor = self.executor is None
+        if own_executor:
+            self.executor = ThreadPoolExecutor(max_workers=DISK_WORKERS, thread_name_prefix="download")
+        self.pool = AsyncDataPool(self.peer_name, self.encodings)
+        # Fontes novas chegam por outra thread (SourceRefresher)
+        loop = asyncio.get_running_loop()
+        self.scheduler.on_change = lambda: loop.call_soon_threadsafe(self._notify)
+        try:
+            # Um worker por requisição simultânea permitida; a janela de cada peer fica no escalonador
+            workers = [self._worker() for _ in range(self.scheduler.controller.max_total)]
+            await asyncio.gather(*workers)
+        finally:
+            self.scheduler.on_change = None
+            self.pool.close_all()
+            if own_executor:
+                self.executor.shutdown(wait=True)
+                self.executor = None
+        return self.scheduler.failed
+
+    def _notify(self):
+        """ Acorda os workers ociosos: um chunk foi concluído ou falhou (liberando a janela de um peer) ou há fontes novas """
+        waiters, self.waiters = self.waiters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    async def _wait_for_change(self):
+        # O futuro é registrado antes da espera, para que nenhum aviso se perca. Além dos avisos,
+        # a espera só termina no próximo evento que depende do tempo (nova rodada de tentativas
+        # ou requisição lenta, que pode ser duplicada)
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, self.scheduler.next_timeout())
+        except asyncio.TimeoutError:
+            pass
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            request = self.scheduler.poll_request()
+            if request is None:
+                if self.scheduler.finished():
+                    return
+                await self._wait_for_change()
+                continue
+            chunk, peer, hedged = request
+            chunk_id = chunk["chunk_id"]
+            # A requisição principal grava no arquivo parcial enquanto o chunk não for concluído
+            # por outra; as duplicadas ficam em memória até a verificação
+            target = ChunkBuffer() if hedged else self.scheduler.output_for(chunk_id, self.partial)
+            try:
+                length = await self._fetch(chunk, peer, target, 0 if hedged else self._offset(chunk))
+                data = target.data if hedged else None
+                first = await loop.run_in_executor(self.executor, self._complete, chunk, peer, length, data)
+                if first:
+                    print(f"Chunk '{chunk['chunk_name']}' baixado com sucesso de {peer}"
+                          f"{' (duplicado)' if hedged else ''}.")
+            except TransferCancelled:
+                self.scheduler.fail(chunk_id, peer, "cancelado")
+            except Exception as e:
+                print(f"Erro ao baixar chunk de {peer}: {e}")
+                # O chunk volta para a fila e será pedido a outro peer que o possua
+                self.scheduler.fail(chunk_id, peer, str(e) or type(e).__name__)
+            self._notify()
+
+    async def _fetch(self, chunk, peer, output, offset):
+        """
+        Recebe um chunk pelo canal de dados ou, na falta dele, por XML-RPC, gravando-o na posição
+        `offset` de `output`. Retorna o tamanho do chunk verificado.
+        """
+        loop = asyncio.get_running_loop()
+        peer_address = self.addresses.get(peer)
+        if peer_address is None:
+            raise IOError("Peer não encontrado.")
+        data_address = await loop.run_in_executor(None, get_data_address, peer_address)
+        if data_address is None:
+            response = await loop.run_in_executor(
+                None, lambda: PooledServerProxy(peer_address).send_chunk(self._request_name(chunk), list(self.encodings)))
+            if not isinstance(response, dict):
+                raise IOError(response)
+            writer = ChunkWriter(output, offset, response["encoding"] or None, response["length"])
+            await loop.run_in_executor(self.executor, writer.write, response["data"].data)
+            return await loop.run_in_executor(self.executor, writer.finish, chunk)
+        data_address = tuple(data_address)
+        conn = await self.pool.acquire(data_address)
+        try:
+            length = await self._receive(conn, chunk, output, offset)
+        except BaseException:
+            # Conexão em estado indefinido (erro ou transferência cancelada no meio)
+            conn.close()
+            raise
+        self.pool.release(data_address, conn)
+        return length
+
+    def _request_name(self, chunk):
+        if chunk["checksum"]:
+            return content_chunk_name(chunk["checksum"])
+        return chunk["chunk_name"]
+
+    def _offset(self, chunk):
+        offset = chunk.get("offset")
+        if offset is None:
+            offset = chunk["chunk_id"] * self.chunk_size
+        return offset
+
+    async def _receive(self, conn, chunk, output, offset):
+        """ Recebe o chunk em blocos de até WRITE_BUFFER bytes, gravados à medida que chegam """
+        loop = asyncio.get_running_loop()
+        chunk_id, chunk_name = chunk["chunk_id"], chunk["chunk_name"]
+        conn.writer.write(f"GET {self._request_name(chunk)}\n".encode("utf-8"))
+        await conn.writer.drain()
+        length, encoding, original_length = parse_header(await asyncio.wait_for(conn.reader.readline(), DATA_TIMEOUT))
+        writer = ChunkWriter(output, offset, encoding, original_length)
+        received = 0
+        buffer = bytearray()
+        while received < length:
+            if self.scheduler.is_done(chunk_id):
+                raise TransferCancelled()
+            block = await asyncio.wait_for(conn.reader.read(min(RECV_BUFFER, length - received)), DATA_TIMEOUT)
+            if not block:
+                raise IOError(f"Conexão encerrada antes do fim do chunk '{chunk_name}'.")
+            received += len(block)
+            buffer += block
+            if len(buffer) >= WRITE_BUFFER or received == length:
+                data, buffer = buffer, bytearray()
+                await loop.run_in_executor(self.executor, writer.write, data)
+        return await loop.run_in_executor(self.executor, writer.finish, chunk)
+
+    def _complete(self, chunk, peer, length, data=None):
+        """
+        Registra a conclusão do chunk já verificado (executado no pool de threads). A cópia de uma
+        requisição duplicada (`data`) só é gravada se nenhuma outra requisição concluiu o chunk antes.
+        Retorna True se esta foi a primeira.
+        """
+        chunk_id = chunk["chunk_id"]
+        if data is None:
+            first = self.scheduler.complete(chunk_id, peer, length)
+        else:
+            first = self.scheduler.complete(chunk_id, peer, length, self.partial, self._offset(chunk), data)
+        if first and self.on_chunk is not None:
+            self.on_chunk(chunk, length)
+        return first
@@ -0,0 +1,232 @@
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+import hashlib
+import zlib
+import os
+
+# Tamanho máximo do buffer usado na leitura dos arquivos (a memória usada não depende do tamanho do arquivo)
+BUFFER_SIZE = 1024 * 1024
+# Threads usadas para calcular os checksums (o hashlib libera o GIL, então os chunks são
+# resumidos em paralelo por vários núcleos); 1 = cálculo sequencial na thread que lê o arquivo
+HASH_WORKERS = os.cpu_count() or 1
+# Trabalhos (chunks ou blocos lidos) aguardando as threads de checksum antes que a leitura
+# espere, por thread: limita a memória usada pela leitura antecipada
+HASH_QUEUE_PER_WORKER = 4
+
+# Tamanho dos chunks de arquivos registrados sem tamanho informado (formato antigo)
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+# Limites do tamanho de chunk escolhido automaticamente para cada arquivo
+MIN_CHUNK_SIZE = 64 * 1024
+MAX_CHUNK_SIZE = 16 * 1024 * 1024
+# Número de chunks buscado na escolha automática: paralelismo suficiente para arquivos pequenos,
+# sem milhares de entradas no tracker para arquivos grandes
+TARGET_CHUNK_COUNT = 256
+
+def choose_chunk_size(file_size):
+    """
+    Escolhe o tamanho de chunk de um arquivo: a menor potência de 2 que divide o arquivo em
+    até TARGET_CHUNK_COUNT chunks, limitada a [MIN_CHUNK_SIZE, MAX_CHUNK_SIZE].
+    """
+    chunk_size = MIN_CHUNK_SIZE
+    while chunk_size < MAX_CHUNK_SIZE and chunk_size * TARGET_CHUNK_COUNT < file_size:
+        chunk_size *= 2
+    return chunk_size
+
+def _digest_parts(parts):
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part)
+    return digest.hexdigest()
+
+class PendingDigest:
+    """ Guarda os trechos de um chunk para que o SHA-256 seja calculado depois, em outra thread """
+    def __init__(self):
+        self.parts = []
+
+    def update(self, data):
+        self.parts.append(data)
+
+class StreamingHasher:
+    """
+    Calcula, em uma única passagem, o SHA-256 de cada chunk e o SHA-256 do arquivo inteiro.
+    Os dados são recebidos em blocos de qualquer tamanho por update().
+    Com `workers` > 1, a thread que chama update() só delimita os chunks: o checksum de cada
+    chunk é calculado em um pool de threads e o do arquivo inteiro (que é sequencial) em uma
+    thread própria, enquanto os próximos blocos são lidos. O resultado é o mesmo do cálculo
+    sequencial. Chame close() (ou finish()) para liberar as threads.
+    """
+    def __init__(self, chunk_size, workers=1):
+        self.chunk_size = chunk_size
+        self.file_digest = hashlib.sha256()
+        self.chunk_start = 0
+        self.chunk_length = 0
+        # Lista de (index, offset, tamanho, checksum) dos chunks já concluídos; com workers > 1,
+        # o checksum é um Future até finish()
+        self.chunks = []
+        self.chunk_pool = None
+        self.file_pool = None
+        if workers > 1:
+            self.chunk_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="hash")
+            # Uma única thread aplica os blocos ao checksum do arquivo, na ordem de leitura
+            self.file_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="hash-file")
+        self.max_pending = max(workers, 1) * HASH_QUEUE_PER_WORKER
+        self.pending = deque()
+        self.chunk_digest = self._new_digest()
+
+    def _new_digest(self):
+        return PendingDigest() if self.chunk_pool is not None else hashlib.sha256()
+
+    def _wait_pending(self):
+        # Limita a leitura antecipada: cada trabalho pendente mantém seus blocos na memória
+        while len(self.pending) > self.max_pending:
+            self.pending.popleft().result()
+
+    def update(self, data):
+        if self.file_pool is not None:
+            self.pending.append(self.file_pool.submit(self.file_digest.update, data))
+            self._update_chunks(data)
+            self._wait_pending()
+        else:
+            self.file_digest.update(data)
+            self._update_chunks(data)
+
+    def _update_chunks(self, data):
+        view = memoryview(data)
+        while view:
+            take = min(len(view), self.chunk_size - self.chunk_length)
+            self.chunk_digest.update(view[:take])
+            self.chunk_length += take
+            view = view[take:]
+            if self.chunk_length == self.chunk_size:
+                self._close_chunk()
+
+    def _close_chunk(self):
+        if self.chunk_pool is not None:
+            checksum = self.chunk_pool.submit(_digest_parts, self.chunk_digest.parts)
+            self.pending.append(checksum)
+        else:
+            checksum = self.chunk_digest.hexdigest()
+        self.chunks.append((len(self.chunks), self.chunk_start, self.chunk_length, checksum))
+        self.chunk_start += self.chunk_length
+        self.chunk_length = 0
+        self.chunk_digest = self._new_digest()
+
+    def finish(self):
+        """ Retorna (checksum do arquivo, lista de chunks) """
+        if self.chunk_length:
+            self._close_chunk()
+        if self.chunk_pool is not None:
+            while self.pending:
+                self.pending.popleft().result()
+            self.chunks = [(index, offset, length, checksum.result()) for index, offset, length, checksum in self.chunks]
+            self.close()
+        return self.file_digest.hexdigest(), self.chunks
+
+    def close(self):
+        if self.chunk_pool is not None:
+            self.chunk_pool.shutdown(wait=True)
+            self.file_pool.shutdown(wait=True)
+
+class ContentDefinedHasher(StreamingHasher):
+    """
+    Variante de StreamingHasher com fronteiras definidas pelo conteúdo (content-defined chunking).
+    As fronteiras ficam em fins de linha escolhidos por um hash (CRC-32) da própria linha: um
+    fim de linha é fronteira com probabilidade proporcional ao tamanho da linha, o que dá
+    chunks de `chunk_size` bytes em média (entre 1/4 e 2x esse valor). Como a decisão só
+    depende da linha, inserir ou remover texto altera apenas os chunks daquele trecho, e os
+    demais mantêm o mesmo checksum. Trechos sem quebras de linha são cortados no tamanho máximo.
+    """
+    def __init__(self, chunk_size, workers=1):
+        super().__init__(chunk_size, workers)
+        self.min_size = chunk_size // 4
+        self.max_size = chunk_size * 2
+        # Uma linha de n bytes é fronteira se crc * (média - mínimo) < n * 2^32
+        self.spread = chunk_size - self.min_size
+        self.line_crc = 0
+        self.line_length = 0
+
+    def _update_chunks(self, data):
+        view = memoryview(data)
+        size = len(data)
+        # Início do trecho de `data` que pertence ao chunk atual e ainda não foi resumido
+        start = 0
+        scan = 0
+        while scan < size:
+            newline = data.find(b"\n", scan)
+            end = size if newline < 0 else newline + 1
+            room = self.max_size - self.chunk_length - (scan - start)
+            if end - scan >= room and (newline < 0 or end - scan > room):
+                # O chunk atinge o tamanho máximo no meio desta linha
+                cut = scan + room
+                self.line_crc = zlib.crc32(view[scan:cut], self.line_crc)
+                self.line_length += room
+                self._cut(view, start, cut)
+                start = scan = cut
+                continue
+            self.line_crc = zlib.crc32(view[scan:end], self.line_crc)
+            self.line_length += end - scan
+            scan = end
+            if newline < 0:
+                break
+            length = self.chunk_length + (scan - start)
+            boundary = length >= self.min_size and self.line_crc * self.spread < self.line_length << 32
+            self.line_crc = 0
+            self.line_length = 0
+            if boundary or length >= self.max_size:
+                self._cut(view, start, scan)
+                start = scan
+        self.chunk_digest.update(view[start:])
+        self.chunk_length += size - start
+
+    def _cut(self, view, start, end):
+        self.chunk_digest.update(view[start:end])
+        self.chunk_length += end - start
+        self._close_chunk()
+
+def hash_file(file_name, chunk_size, content_defined=False, buffer_size=BUFFER_SIZE, workers=HASH_WORKERS):
+    """
+    Lê o arquivo uma única vez com um buffer limitado e retorna
+    (checksum do arquivo, [(index, offset, tamanho, checksum do chunk), ...]).
+    Com `content_defined`, os chunks têm tamanho variável (ContentDefinedHasher).
+    Os checksums são calculados por até `workers` threads enquanto o arquivo é lido.
+    """
+    hasher = ContentDefinedHasher(chunk_size, workers) if content_defined else StreamingHasher(chunk_size, workers)
+    try:
+        with open(file_name, "rb") as f:
+            while True:
+                data = f.read(buffer_size)
+                if not data:
+                    break
+                hasher.update(data)
+        return hasher.finish()
+    finally:
+        hasher.close()
+
+def file_checksum(file_name, buffer_size=BUFFER_SIZE, workers=HASH_WORKERS):
+    """
+    Calcula o SHA-256 de um arquivo inteiro lendo-o em blocos. O checksum do arquivo é
+    sequencial; com `workers` > 1, ele é calculado em outra thread enquanto os blocos seguintes
+    são lidos.
+    """
+    digest = hashlib.sha256()
+    if workers <= 1:
+        with open(file_name, "rb") as f:
+            while True:
+                data = f.read(buffer_size)
+                if not data:
+                    break
+                digest.update(data)
+        return digest.hexdigest()
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="hash-file") as pool:
+        with open(file_name, "rb") as f:
+            while True:
+                data = f.read(buffer_size)
+                if not data:
+                    break
+                pending.append(pool.submit(digest.update, data))
+                while len(pending) > HASH_QUEUE_PER_WORKER:
+                    pending.popleft().result()
+        while pending:
+            pending.popleft().result()
+    return digest.hexdigest()
@@ -0,0 +1,90 @@
+import threading
+import json
+import os
+
+# Arquivo, no diretório do peer, com os checksums já calculados dos arquivos compartilhados
+MANIFEST_FILE = ".share_manifest.json"
+# Checksums anteriores guardados para cada arquivo, informados ao tracker junto com o atual
+MAX_PREVIOUS_CHECKSUMS = 8
+
+def file_signature(path):
+    """ Identifica o estado atual de um arquivo: [tamanho, mtime (ns), inode] """
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns, st.st_ino]
+
+class ShareManifest:
+    """
+    Cache persistente do processamento dos arquivos compartilhados: para cada arquivo, guarda o
+    checksum final, o tamanho de chunk e os chunks (index, offset, tamanho, checksum), junto com
+    a assinatura (tamanho, mtime, inode) do arquivo no momento em que foi lido.
+    Enquanto a assinatura não muda, o arquivo pode ser anunciado novamente sem ser relido; um
+    arquivo inalterado também mantém a divisão em chunks com que foi anunciado.
+    Os últimos checksums que o arquivo já teve também são guardados: com eles, o tracker sabe
+    que a versão atual substitui as anteriores, e não o contrário.
+    """
+    def __init__(self, path=MANIFEST_FILE):
+        self.path = path
+        self.entries = self._load()
+        self.lock = threading.Lock()
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return entries if isinstance(entries, dict) else {}
+
+    def lookup(self, file_name):
+        """ Retorna (checksum, tamanho de chunk, chunks) se o arquivo não mudou, ou None """
+        try:
+            signature = file_signature(file_name)
+        except OSError:
+            return None
+        with self.lock:
+            entry = self.entries.get(file_name)
+        if entry is None or entry.get("signature") != signature:
+            return None
+        return entry["checksum"], entry["chunk_size"], [tuple(chunk) for chunk in entry["chunks"]]
+
+    def store(self, file_name, signature, checksum, chunk_size, chunks):
+        """ Registra o resultado do processamento; `signature` deve ser obtida antes da leitura do arquivo """
+        with self.lock:
+            entry = self.entries.get(file_name)
+            previous = entry.get("previous", []) if entry is not None else []
+            if entry is not None and entry["checksum"] != checksum:
+                previous = [c for c in previous if c != entry["checksum"]] + [entry["checksum"]]
+            self.entries[file_name] = {
+                "signature": list(signature),
+                "checksum": checksum,
+                "chunk_size": chunk_size,
+                "chunks": [list(chunk) for chunk in chunks],
+                "previous": [c for c in previous if c != checksum][-MAX_PREVIOUS_CHECKSUMS:],
+            }
+
+    def previous_checksums(self, file_name):
+        """ Checksums que o arquivo já teve, do mais antigo para o mais recente """
+        with self.lock:
+            entry = self.entries.get(file_name)
+            return list(entry.get("previous", [])) if entry is not None else []
+
+    def prune(self, file_names):
+        """ Remove as entradas de arquivos que não estão mais em `file_names` """
+        keep = set(file_names)
+        with self.lock:
+            for file_name in [name for name in self.entries if name not in keep]:
+                del self.entries[file_name]
+
+    def save(self):
+        """ Grava o manifesto de forma atômica """
+        with self.lock:
+            data = json.dumps(self.entries)
+            temp_path = f"{self.path}.tmp"
+            try:
+                with open(temp_path, "w", encoding="utf-8") as f:
+                    f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(temp_path, self.path)
+            except OSError as e:
+                print(f"Erro ao gravar o manifesto de arquivos compartilhados: {e}")
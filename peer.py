@@ -1,62 +1,139 @@
-from xmlrpc.server import SimpleXMLRPCServer
 import xmlrpc.client
 import threading
 import time
 import os
 import random
 import hashlib
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import shutil
+from tracker_client import ChunkAnnouncer, ShardedTracker, is_error
+from connpool import PooledServerProxy, ThreadedXMLRPCServer
+from transfer import ChunkDataServer
+from storage import ChunkTable, read_range
+from scheduler import MAX_IN_FLIGHT
+from hashing import hash_file, file_checksum, choose_chunk_size, BUFFER_SIZE
+from download import FileDownloader
+from upload import UploadLimiter, UPLOAD_SLOTS, print_upload_stats
+from cache import ChunkCache, CHUNK_CACHE_BYTES
+from compression import choose_encoding
+from manifest import ShareManifest, file_signature
 
-CHUNK_SIZE = 1024 * 1024  # 1MB
+# Tamanho fixo dos chunks dos arquivos compartilhados; None = escolhido para cada arquivo
+# conforme o tamanho dele (choose_chunk_size), mantendo limitado o número de chunks
+CHUNK_SIZE = None
+WRITE_CHUNK_FILES = False  # Se True, cada chunk também é gravado em um arquivo '{arquivo}.chunkN'
+# Se True, os limites dos chunks são definidos pelo conteúdo (tamanho variável, em média o tamanho de chunk):
+# uma inserção no arquivo altera só os chunks vizinhos, e o conteúdo repetido é reaproveitado
+CONTENT_DEFINED_CHUNKING = False
+# Threads usadas para calcular os checksums dos arquivos compartilhados e baixados (1 = sequencial)
+HASH_WORKERS = os.cpu_count() or 1
 PORT = random.randint(10000, 60000)
+# Endereços do tracker; com vários, os arquivos são divididos entre eles (tracker particionado)
+TRACKER_ADDRESSES = ['http://localhost:9000']
 exit_flag = threading.Event()
+data_server = None  # Canal de dados (TCP) usado para transferir os chunks
+# Checksums dos arquivos compartilhados, para não reprocessar na inicialização os que não mudaram
+share_manifest = ShareManifest()
+# Chunks oferecidos por este peer: chunk_name -> (arquivo, offset, tamanho); os mais pedidos ficam em memória
+chunk_table = ChunkTable(ChunkCache(CHUNK_CACHE_BYTES))
+UPLOAD_RATE = None  # Limite global de upload em bytes/s (None = sem limite)
+PEER_UPLOAD_RATE = None  # Limite de upload para cada peer em bytes/s (None = sem limite)
+# Slots de upload com fila justa entre os peers e limites de banda do lado que serve os chunks
+upload_limiter = UploadLimiter(UPLOAD_SLOTS, UPLOAD_RATE, PEER_UPLOAD_RATE)
 
 def calculate_checksum(data):
     """ Calcula o checksum SHA-256 de um bloco de dados """
     return hashlib.sha256(data).hexdigest()
 
 def compute_file_checksum(file_name):
-    """ Calcula o checksum SHA-256 de um arquivo inteiro """
-    with open(file_name, "rb") as f:
-        data = f.read()
-    return calculate_checksum(data)
+    """ Calcula o checksum SHA-256 de um arquivo inteiro, lendo-o em blocos """
+    return file_checksum(file_name, workers=HASH_WORKERS)
 
-def split_file(file_name):
+def local_file_checksum(file_name):
+    """ Checksum de um arquivo local, obtido do share_manifest se o arquivo não mudou desde então """
+    cached = share_manifest.lookup(file_name)
+    if cached is not None:
+        return cached[0]
+    return compute_file_checksum(file_name)
+
+def share_ranges(file_name, ranges, reuse_chunk_files=False):
     """
-    Divide um arquivo em chunks de 1MB, calcula seus checksums e atribui um identificador único para cada bloco.
-    Cada chunk é identificado por um número sequencial (index) utilizado também no nome do arquivo do chunk.
-    Retorna uma lista de tuplas: (chunk_id, chunk_name, checksum)
+    Disponibiliza os chunks de um arquivo já processado por hash_file.
+    Os chunks são registrados na chunk_table como intervalos do arquivo original; só são gravados
+    em arquivos separados se WRITE_CHUNK_FILES estiver ativo (com `reuse_chunk_files`, arquivos
+    de chunk já existentes, de um arquivo que não mudou, não são regravados).
+    Retorna uma lista de tuplas: (chunk_id, chunk_name, checksum, offset, tamanho)
     """
     chunks = []
+    for index, offset, length, checksum in ranges:
+        chunk_name = f"{file_name}.chunk{index}"
+        if WRITE_CHUNK_FILES:
+            if not (reuse_chunk_files and os.path.exists(chunk_name) and os.path.getsize(chunk_name) == length):
+                with open(chunk_name, "wb") as chunk_file:
+                    chunk_file.write(read_range(file_name, offset, length))
+            chunk_table.add(chunk_name, chunk_name, 0, length, checksum)
+        else:
+            # O chunk é servido diretamente como intervalo de bytes do arquivo original
+            chunk_table.add(chunk_name, file_name, offset, length, checksum)
+        chunks.append((index, chunk_name, checksum, offset, length))
+    return chunks
+
+def index_file(file_name):
+    """
+    Divide um arquivo em chunks (de CHUNK_SIZE ou do tamanho escolhido para o arquivo; de tamanho
+    variável, com CONTENT_DEFINED_CHUNKING), calculando em uma única leitura o checksum de cada
+    chunk e o checksum final do arquivo.
+    Cada chunk é identificado por um número sequencial (index) utilizado também no nome do chunk.
+    Arquivos que não mudaram desde o último processamento são lidos do share_manifest, sem
+    serem relidos do disco.
+    Retorna (lista de tuplas (chunk_id, chunk_name, checksum, offset, tamanho), checksum do arquivo,
+    tamanho de chunk).
+    """
     if not os.path.exists(file_name):
-        return chunks
+        return [], None, None
+    cached = share_manifest.lookup(file_name)
+    if cached is not None:
+        final_checksum, chunk_size, ranges = cached
+    else:
+        # A assinatura é obtida antes da leitura: uma alteração durante o processamento invalida a entrada
+        signature = file_signature(file_name)
+        chunk_size = CHUNK_SIZE or choose_chunk_size(signature[0])
+        final_checksum, ranges = hash_file(file_name, chunk_size, CONTENT_DEFINED_CHUNKING, workers=HASH_WORKERS)
+        share_manifest.store(file_name, signature, final_checksum, chunk_size, ranges)
+    return share_ranges(file_name, ranges, cached is not None), final_checksum, chunk_size
 
-    with open(file_name, "rb") as f:
-        index = 0
-        while True:
-            chunk = f.read(CHUNK_SIZE)
-            if not chunk:
-                break
-            checksum = calculate_checksum(chunk)
-            chunk_name = f"{file_name}.chunk{index}"
-            with open(chunk_name, "wb") as chunk_file:
-                chunk_file.write(chunk)
-            chunks.append((index, chunk_name, checksum))
-            index += 1
-    
+def split_file(file_name):
+    """
+    Divide um arquivo em chunks, calcula seus checksums e atribui um identificador único para cada bloco.
+    Retorna uma lista de tuplas: (chunk_id, chunk_name, checksum, offset, tamanho)
+    """
+    chunks, _, _ = index_file(file_name)
     return chunks
 
-def send_chunk(chunk_name):
-    """ Envia um chunk específico para outro peer """
+def send_chunk(chunk_name, accept=None):
+    """
+    Envia um chunk específico para outro peer.
+    Se `accept` (compressões aceitas, em ordem de preferência) for informado, retorna
+    {"data", "encoding", "length"}, com os dados possivelmente comprimidos e o tamanho original.
+    """
     try:
-        with open(chunk_name, "rb") as f:
-            data = f.read()
-        return xmlrpc.client.Binary(data)
+        encoding = choose_encoding(accept)
+        # Pedidos via XML-RPC não identificam o peer e compartilham uma fila
+        with upload_limiter.slot("xmlrpc"):
+            data, encoding, length = chunk_table.read_payload(chunk_name, encoding)
+            upload_limiter.throttle("xmlrpc", len(data))
+            upload_limiter.record("xmlrpc", len(data))
+        if accept is None:
+            return xmlrpc.client.Binary(data)
+        return {"data": xmlrpc.client.Binary(data), "encoding": encoding or "", "length": length}
     except FileNotFoundError:
         return f"Erro: Chunk '{chunk_name}' não encontrado."
     except Exception as e:
         return f"Erro: {e}"
 
+def get_data_port():
+    """ Retorna a porta do canal de dados deste peer """
+    return data_server.port
+
 def get_files():
     """
     Lista os arquivos .txt disponíveis no diretório do peer,
@@ -72,7 +149,7 @@ def receive_message(message, from_peer):
 def send_message(peer_name, peer_address, sender_name):
     """ Envia uma mensagem para outro peer """
     try:
-        with xmlrpc.client.ServerProxy(peer_address) as peer_proxy:
+        with PooledServerProxy(peer_address) as peer_proxy:
             while not exit_flag.is_set():
                 message = input(f"{sender_name} (Você): ")
                 if message.lower() == 'exit':
@@ -82,32 +159,6 @@ def send_message(peer_name, peer_address, sender_name):
     except Exception as e:
         print(f"Erro ao conversar com {peer_name}: {e}")
 
-def download_chunk(peer_name, peer_address, chunk_name, expected_checksum=None):
-    """
-    Faz o download de um chunk de outro peer.
-    Se expected_checksum for informado, verifica a integridade do bloco baixado.
-    """
-    try:
-        with xmlrpc.client.ServerProxy(peer_address) as peer_proxy:
-            response = peer_proxy.send_chunk(chunk_name)
-            if isinstance(response, xmlrpc.client.Binary):
-                data = response.data
-                if expected_checksum:
-                    downloaded_checksum = calculate_checksum(data)
-                    if downloaded_checksum != expected_checksum:
-                        print(f"Erro: Checksum do chunk '{chunk_name}' não confere.")
-                        return False
-                with open(chunk_name, "wb") as f:
-                    f.write(data)
-                print(f"Chunk '{chunk_name}' baixado com sucesso de {peer_name}.")
-                return True
-            else:
-                print(response)
-                return False
-    except Exception as e:
-        print(f"Erro ao baixar chunk de {peer_name}: {e}")
-        return False
-
 def assemble_file(original_file_name, output_file=None):
     """
     Reconstroi o arquivo original a partir dos seus chunks.
@@ -121,8 +172,9 @@ def assemble_file(original_file_name, output_file=None):
             chunk_file = f"{original_file_name}.chunk{index}"
             if not os.path.exists(chunk_file):
                 break
+            # Cópia em blocos: a memória usada não depende do tamanho de chunk do arquivo
             with open(chunk_file, "rb") as infile:
-                outfile.write(infile.read())
+                shutil.copyfileobj(infile, outfile, BUFFER_SIZE)
             index += 1
     print(f"Arquivo reassemblado como {output_file}.")
     
@@ -135,20 +187,27 @@ def list_files_from_peers(proxy):
     print("\nPeers conectados e arquivos disponíveis:")
     for peer_name, peer_address in peers.items():
         try:
-            with xmlrpc.client.ServerProxy(peer_address) as peer_proxy:
+            with PooledServerProxy(peer_address) as peer_proxy:
                 files = peer_proxy.get_files()
                 print(f"{peer_name}: {files}")
         except Exception as e:
             print(f"Não foi possível obter arquivos de {peer_name}: {e}")
 
-def register_chunks(proxy, peer_name, file_name, chunks, file_checksum=None):
+def register_chunks(proxy, peer_name, file_name, chunks, file_checksum=None, chunk_size=None):
     """
     Registra os chunks de um arquivo no tracker.
-    Cada chunk é uma tupla (chunk_id, chunk_name, checksum).
-    O checksum final do arquivo (se calculado) também é enviado.
+    Cada chunk é uma tupla (chunk_id, chunk_name, checksum, offset, tamanho).
+    O checksum final do arquivo (se calculado) também é enviado, junto com os checksums que o
+    arquivo já teve: o tracker só troca a versão registrada por uma que a substitui.
     """
-    proxy.register_chunks(peer_name, file_name, chunks, file_checksum)
-    print(f"Chunks do arquivo '{file_name}' registrados no tracker (por {peer_name}).")
+    response = proxy.register_chunks(peer_name, file_name, chunks, file_checksum, chunk_size,
+                                     share_manifest.previous_checksums(file_name))
+    if is_error(response):
+        print(response)
+    elif response:
+        print(f"Chunks do arquivo '{file_name}' registrados no tracker (por {peer_name}).")
+    else:
+        print(f"O tracker mantém outra versão de '{file_name}'; a cópia local não foi anunciada.")
 
 def share_file(file_name, proxy, peer_name):
     """
@@ -161,10 +220,10 @@ def share_file(file_name, proxy, peer_name):
     if not file_name.endswith(".txt"):
         print("Apenas arquivos com extensão .txt podem ser compartilhados.")
         return
-    file_checksum = compute_file_checksum(file_name)
-    chunks = split_file(file_name)
+    chunks, final_checksum, chunk_size = index_file(file_name)
+    share_manifest.save()
     if chunks:
-        register_chunks(proxy, peer_name, file_name, chunks, file_checksum)
+        register_chunks(proxy, peer_name, file_name, chunks, final_checksum, chunk_size)
         print(f"Arquivo '{file_name}' compartilhado com sucesso.")
     else:
         print("Nenhum chunk foi criado.")
@@ -173,97 +232,81 @@ def share_all_txt_files(proxy, peer_name):
     """
     Percorre todos os arquivos .txt do diretório (exceto chunks),
     quebra cada um em chunks e os registra no tracker.
+    Os arquivos que não mudaram desde o último processamento (share_manifest) são anunciados
+    imediatamente, em um único lote; os novos ou modificados são processados em segundo plano.
     """
     files = get_files()
     if not files:
         print("Nenhum arquivo .txt encontrado para compartilhar automaticamente.")
+    share_manifest.prune(files)
+    announcements = []
+    changed = []
     for file in files:
-        file_checksum = compute_file_checksum(file)
-        chunks = split_file(file)
+        if share_manifest.lookup(file) is None:
+            changed.append(file)
+            continue
+        chunks, final_checksum, chunk_size = index_file(file)
         if chunks:
-            register_chunks(proxy, peer_name, file, chunks, file_checksum)
+            announcements.append([file, chunks, final_checksum, chunk_size, share_manifest.previous_checksums(file)])
+    if announcements:
+        response = proxy.register_chunks_batch(peer_name, announcements)
+        if is_error(response):
+            print(response)
+        else:
+            print(f"{len(announcements)} arquivo(s) sem alterações anunciados a partir do manifesto.")
+    share_manifest.save()
+    if changed:
+        print(f"Processando {len(changed)} arquivo(s) novo(s) ou modificado(s) em segundo plano...")
+        threading.Thread(target=share_changed_files, args=(proxy, peer_name, changed), daemon=True).start()
+
+def share_changed_files(proxy, peer_name, files):
+    """ Calcula os checksums e registra no tracker os arquivos novos ou modificados """
+    for file in files:
+        if exit_flag.is_set():
+            break
+        try:
+            chunks, final_checksum, chunk_size = index_file(file)
+            if chunks:
+                register_chunks(proxy, peer_name, file, chunks, final_checksum, chunk_size)
+        except Exception as e:
+            print(f"Erro ao compartilhar {file}: {e}")
+    share_manifest.save()
 
-def download_file(proxy, local_peer_name):
+def download_file(proxy, local_peer_name, announcer):
     """
-    Realiza o download completo de um arquivo:
-      - O usuário informa o nome do arquivo a ser baixado.
-      - São consultados todos os chunks do arquivo no tracker.
-      - O usuário informa quantas conexões paralelas deseja usar.
-      - Cada chunk é baixado em paralelo e, assim que for baixado com sucesso,
-        ele é imediatamente registrado no tracker para que este peer passe a ser seeder daquele chunk.
-      - Ao final, o arquivo é reagrupado, seu checksum é verificado e, se completo,
-        todos os chunks são registrados novamente.
+    Baixa um arquivo da rede (fluxo comum em download.FileDownloader):
+      - O usuário informa o nome do arquivo a ser baixado; o plano de download é obtido do
+        tracker e conferido.
+      - O usuário informa o limite de conexões paralelas (ou deixa o ajuste automático); dentro
+        desse limite, o número de requisições simultâneas a cada peer é ajustado por AIMD
+        conforme a vazão medida e os erros.
+      - Se o download for interrompido, o próximo 'get' do mesmo arquivo baixa apenas os chunks
+        que ainda faltam ou que não passaram na verificação.
+    Erros do download são informados sem encerrar o peer.
     """
-    file_to_get = input("Digite o nome do arquivo que deseja baixar: ").strip()
-    chunks = proxy.get_file_chunks(file_to_get)
-    if not chunks:
-        print("Nenhum chunk encontrado para esse arquivo.")
-        return
-    final_checksum = proxy.get_file_checksum(file_to_get)
-    if final_checksum == "Checksum não encontrado.":
-        print("Checksum final do arquivo não encontrado.")
-        return
     try:
-        num_connections = int(input("Digite o número de conexões paralelas: "))
-    except ValueError:
-        print("Valor inválido para conexões.")
-        return
-
-    # Ordena os chunks pela ordem do chunk_id (ou 0 se None)
-    chunks.sort(key=lambda x: x[1] if x[1] is not None else 0)
-
-    def download_individual_chunk(chunk_info):
-        peer, chunk_id, chunk_name, chunk_checksum = chunk_info
-        peer_addr = proxy.get_peer_address(peer)
-        if peer_addr == "Peer não encontrado.":
-            print(f"Peer {peer} não encontrado para chunk {chunk_name}.")
-            return False
-        result = download_chunk(peer, peer_addr, chunk_name, chunk_checksum)
-        if result:
-            # Assim que o chunk for baixado, registra-o no tracker para que este peer passe a oferecê-lo
-            proxy.register_chunks(local_peer_name, file_to_get, [(chunk_id, chunk_name, chunk_checksum)], final_checksum)
-            return True
-        return False
-
-    print("Iniciando download dos chunks...")
-    with ThreadPoolExecutor(max_workers=num_connections) as executor:
-        futures = {executor.submit(download_individual_chunk, c): c for c in chunks}
-        for future in as_completed(futures):
-            c = futures[future]
-            try:
-                result = future.result()
-                if not result:
-                    print(f"Falha ao baixar o chunk {c[2]}.")
-            except Exception as e:
-                print(f"Erro ao baixar chunk {c[2]}: {e}")
-
-    print("Todos os chunks foram baixados. Reagrupando o arquivo...")
-    assemble_file(file_to_get)
-    assembled_file = f"{file_to_get}.assembled"
-    if not os.path.exists(assembled_file):
-        print("Erro: arquivo reassemblado não encontrado.")
-        return
-    with open(assembled_file, "rb") as f:
-        assembled_data = f.read()
-    assembled_checksum = calculate_checksum(assembled_data)
-    if assembled_checksum == final_checksum:
-        print("Arquivo baixado com sucesso e o checksum confere!")
-        # Renomeia o arquivo reassemblado para o nome original, se necessário.
-        if not os.path.exists(file_to_get):
-            os.rename(assembled_file, file_to_get)
-        else:
-            os.remove(assembled_file)
-        # Registra novamente todos os chunks para garantir que o peer tem o arquivo completo
-        local_chunks = split_file(file_to_get)
-        register_chunks(proxy, local_peer_name, file_to_get, local_chunks, final_checksum)
-    else:
-        print("O checksum do arquivo reagrupado não confere!")
+        file_to_get = input("Digite o nome do arquivo que deseja baixar: ").strip()
+        downloader = FileDownloader(proxy, local_peer_name, announcer, chunk_table, share_manifest, share_ranges,
+                                    local_file_checksum, HASH_WORKERS)
+        plan = downloader.load_plan(file_to_get)
+        if plan is None:
+            return
+        answer = input("Digite o número máximo de conexões paralelas (Enter para ajuste automático): ").strip()
+        try:
+            num_connections = int(answer) if answer else MAX_IN_FLIGHT
+        except ValueError:
+            print("Valor inválido para conexões.")
+            return
+        downloader.download(plan, num_connections)
+    except Exception as e:
+        print(f"Erro durante o download: {e}")
 
 def connect_to_tracker(name):
     """ Conecta ao tracker e registra o peer """
-    server_address = 'http://localhost:9000'
     try:
-        with xmlrpc.client.ServerProxy(server_address) as proxy:
+        # Proxy compartilhado pelo menu e pelo heartbeat: cada chamada usa uma conexão persistente
+        # do pool, no shard do tracker responsável pelo arquivo
+        with ShardedTracker(TRACKER_ADDRESSES) as proxy:
             response = proxy.register(name, f"http://localhost:{PORT}")
             if response.startswith("Error:"):
                 print(response)
@@ -272,6 +315,7 @@ def connect_to_tracker(name):
 
             # Compartilha automaticamente todos os arquivos .txt do diretório
             share_all_txt_files(proxy, name)
+            announcer = ChunkAnnouncer(TRACKER_ADDRESSES, name, peer_address=f"http://localhost:{PORT}")
 
             def send_heartbeat():
                 while not exit_flag.is_set():
@@ -284,8 +328,13 @@ def connect_to_tracker(name):
             threading.Thread(target=send_heartbeat, daemon=True).start()
 
             def receive_requests():
-                server = SimpleXMLRPCServer(('localhost', PORT), allow_none=True)
+                global data_server
+                data_server = ChunkDataServer('localhost', chunk_table.resolve, limiter=upload_limiter,
+                                              cache=chunk_table.cache)
+                data_server.start()
+                server = ThreadedXMLRPCServer(('localhost', PORT), allow_none=True)
                 server.register_function(send_chunk, 'send_chunk')
+                server.register_function(get_data_port, 'get_data_port')
                 server.register_function(get_files, 'get_files')
                 server.register_function(receive_message, 'receive_message')
                 print(f"Peer iniciado no endereço http://localhost:{PORT}.")
@@ -298,7 +347,8 @@ def connect_to_tracker(name):
                     "\nDigite 'list' para ver peers, 'chunks' para ver blocos de um arquivo,\n"
                     "'chat' para conversar, 'get' para baixar um arquivo completo,\n"
                     "'assemble' para reconstituir um arquivo (se necessário),\n"
-                    "'share' para compartilhar um novo arquivo, 'exit' para sair: "
+                    "'share' para compartilhar um novo arquivo, 'stats' para ver os uploads,\n"
+                    "'exit' para sair: "
                 ).strip().lower()
                 if command == 'list':
                     list_files_from_peers(proxy)
@@ -320,16 +370,19 @@ def connect_to_tracker(name):
                     else:
                         send_message(peer_name_input, peer_address, name)
                 elif command == 'get':
-                    download_file(proxy, name)
+                    download_file(proxy, name, announcer)
                 elif command == 'assemble':
                     original_file = input("Digite o nome original do arquivo (sem a extensão de chunk): ").strip()
                     assemble_file(original_file)
                 elif command == 'share':
                     file_to_share = input("Digite o nome do arquivo .txt para compartilhar: ").strip()
                     share_file(file_to_share, proxy, name)
+                elif command == 'stats':
+                    print_upload_stats(upload_limiter, chunk_table.cache)
                 elif command == 'exit':
                     print("Saindo...")
                     exit_flag.set()
+                    announcer.close()
                     break
                 else:
                     print("Comando inválido. Tente novamente.")
@@ -1,22 +1,55 @@
-from xmlrpc.server import SimpleXMLRPCServer
 import xmlrpc.client
 import threading
-import queue
 import time
 import os
 import random
 import hashlib
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import shutil
+from tracker_client import ChunkAnnouncer, ShardedTracker, is_error
+from connpool import PooledServerProxy, ThreadedXMLRPCServer
+from transfer import ChunkDataServer
+from storage import ChunkTable, read_range
+from scheduler import MAX_IN_FLIGHT
+from hashing import hash_file, file_checksum, choose_chunk_size, BUFFER_SIZE
+from download import FileDownloader
+from upload import UploadLimiter, UPLOAD_SLOTS, print_upload_stats
+from cache import ChunkCache, CHUNK_CACHE_BYTES
+from compression import choose_encoding
+from manifest import ShareManifest, file_signature
 
 # -------------------------
 # CONFIGURAÇÕES GLOBAIS
 # -------------------------
-CHUNK_SIZE = 1024 * 1024  # 1MB
+# Tamanho fixo dos chunks dos arquivos compartilhados; None = escolhido para cada arquivo
+# conforme o tamanho dele (choose_chunk_size), mantendo limitado o número de chunks
+CHUNK_SIZE = None
+WRITE_CHUNK_FILES = False  # Se True, cada chunk também é gravado em um arquivo '{arquivo}.chunkN'
+# Se True, os limites dos chunks são definidos pelo conteúdo (tamanho variável, em média o tamanho de chunk):
+# uma inserção no arquivo altera só os chunks vizinhos, e o conteúdo repetido é reaproveitado
+CONTENT_DEFINED_CHUNKING = False
+# Threads usadas para calcular os checksums dos arquivos compartilhados e baixados (1 = sequencial)
+HASH_WORKERS = os.cpu_count() or 1
 PORT = random.randint(10000, 60000)
 exit_flag = threading.Event()
+data_server = None  # Canal de dados (TCP) usado para transferir os chunks
+# Checksums dos arquivos compartilhados, para não reprocessar na inicialização os que não mudaram
+share_manifest = ShareManifest()
+# Chunks oferecidos por este peer: chunk_name -> (arquivo, offset, tamanho); os mais pedidos ficam em memória
+chunk_table = ChunkTable(ChunkCache(CHUNK_CACHE_BYTES))
+UPLOAD_RATE = None  # Limite global de upload em bytes/s (None = sem limite)
+PEER_UPLOAD_RATE = None  # Limite de upload para cada peer em bytes/s (None = sem limite)
+# Slots de upload com fila justa entre os peers e limites de banda do lado que serve os chunks
+upload_limiter = UploadLimiter(UPLOAD_SLOTS, UPLOAD_RATE, PEER_UPLOAD_RATE)
+
+# Se True, o limite de conexões paralelas depende da contribuição do peer (chunks oferecidos);
+# caso contrário, a concorrência é ajustada automaticamente pela vazão medida.
+CONTRIBUTION_POLICY = False
 
 # Atualize com o endereço IP (e porta) do Tracker na sua rede:
 TRACKER_ADDRESS = 'http://192.168.15.166:9000'  # <-- ALTERE conforme necessário
+# Lista de endereços de um tracker particionado (os arquivos são divididos entre eles);
+# None = apenas TRACKER_ADDRESS
+TRACKER_ADDRESSES = None
 
 def get_local_ip():
     import socket
@@ -35,38 +68,68 @@ def calculate_checksum(data):
     return hashlib.sha256(data).hexdigest()
 
 def compute_file_checksum(file_name):
-    with open(file_name, "rb") as f:
-        data = f.read()
-    return calculate_checksum(data)
+    return file_checksum(file_name, workers=HASH_WORKERS)
 
-def split_file(file_name):
+def local_file_checksum(file_name):
+    # Arquivos que não mudaram desde o último processamento não precisam ser relidos
+    cached = share_manifest.lookup(file_name)
+    if cached is not None:
+        return cached[0]
+    return compute_file_checksum(file_name)
+
+def share_ranges(file_name, ranges, reuse_chunk_files=False):
     chunks = []
+    for index, offset, length, checksum in ranges:
+        chunk_name = f"{file_name}.chunk{index}"
+        if WRITE_CHUNK_FILES:
+            if not (reuse_chunk_files and os.path.exists(chunk_name) and os.path.getsize(chunk_name) == length):
+                with open(chunk_name, "wb") as chunk_file:
+                    chunk_file.write(read_range(file_name, offset, length))
+            chunk_table.add(chunk_name, chunk_name, 0, length, checksum)
+        else:
+            # O chunk é servido diretamente como intervalo de bytes do arquivo original
+            chunk_table.add(chunk_name, file_name, offset, length, checksum)
+        chunks.append((index, chunk_name, checksum, offset, length))
+    return chunks
+
+def index_file(file_name):
+    # Uma única leitura calcula o checksum de cada chunk e o checksum final do arquivo
     if not os.path.exists(file_name):
-        return chunks
-    with open(file_name, "rb") as f:
-        index = 0
-        while True:
-            chunk = f.read(CHUNK_SIZE)
-            if not chunk:
-                break
-            checksum = calculate_checksum(chunk)
-            chunk_name = f"{file_name}.chunk{index}"
-            with open(chunk_name, "wb") as chunk_file:
-                chunk_file.write(chunk)
-            chunks.append((index, chunk_name, checksum))
-            index += 1
+        return [], None, None
+    cached = share_manifest.lookup(file_name)
+    if cached is not None:
+        final_checksum, chunk_size, ranges = cached
+    else:
+        # A assinatura é obtida antes da leitura: uma alteração durante o processamento invalida a entrada
+        signature = file_signature(file_name)
+        chunk_size = CHUNK_SIZE or choose_chunk_size(signature[0])
+        final_checksum, ranges = hash_file(file_name, chunk_size, CONTENT_DEFINED_CHUNKING, workers=HASH_WORKERS)
+        share_manifest.store(file_name, signature, final_checksum, chunk_size, ranges)
+    return share_ranges(file_name, ranges, cached is not None), final_checksum, chunk_size
+
+def split_file(file_name):
+    chunks, _, _ = index_file(file_name)
     return chunks
 
-def send_chunk(chunk_name):
+def send_chunk(chunk_name, accept=None):
     try:
-        with open(chunk_name, "rb") as f:
-            data = f.read()
-        return xmlrpc.client.Binary(data)
+        encoding = choose_encoding(accept)
+        # Pedidos via XML-RPC não identificam o peer e compartilham uma fila
+        with upload_limiter.slot("xmlrpc"):
+            data, encoding, length = chunk_table.read_payload(chunk_name, encoding)
+            upload_limiter.throttle("xmlrpc", len(data))
+            upload_limiter.record("xmlrpc", len(data))
+        if accept is None:
+            return xmlrpc.client.Binary(data)
+        return {"data": xmlrpc.client.Binary(data), "encoding": encoding or "", "length": length}
     except FileNotFoundError:
         return f"Erro: Chunk '{chunk_name}' não encontrado."
     except Exception as e:
         return f"Erro: {e}"
 
+def get_data_port():
+    return data_server.port
+
 def get_files():
     return [f for f in os.listdir() if os.path.isfile(f) and f.endswith(".txt") and ".chunk" not in f]
 
@@ -76,7 +139,7 @@ def receive_message(message, from_peer):
 
 def send_message(peer_name, peer_address, sender_name):
     try:
-        with xmlrpc.client.ServerProxy(peer_address) as peer_proxy:
+        with PooledServerProxy(peer_address) as peer_proxy:
             while not exit_flag.is_set():
                 message = input(f"{sender_name} (Você): ")
                 if message.lower() == 'exit':
@@ -95,15 +158,23 @@ def assemble_file(original_file_name, output_file=None):
             chunk_file = f"{original_file_name}.chunk{index}"
             if not os.path.exists(chunk_file):
                 break
+            # Cópia em blocos: a memória usada não depende do tamanho de chunk do arquivo
             with open(chunk_file, "rb") as infile:
-                outfile.write(infile.read())
+                shutil.copyfileobj(infile, outfile, BUFFER_SIZE)
             index += 1
     print(f"Arquivo reassemblado como {output_file}.")
 
-def register_chunks(proxy, peer_name, file_name, chunks, file_checksum=None):
+def register_chunks(proxy, peer_name, file_name, chunks, file_checksum=None, chunk_size=None):
     try:
-        proxy.register_chunks(peer_name, file_name, chunks, file_checksum)
-        print(f"Chunks do arquivo '{file_name}' registrados no tracker (por {peer_name}).")
+        # Os checksums anteriores do arquivo indicam ao tracker que esta versão substitui aquelas
+        response = proxy.register_chunks(peer_name, file_name, chunks, file_checksum, chunk_size,
+                                         share_manifest.previous_checksums(file_name))
+        if is_error(response):
+            print(response)
+        elif response:
+            print(f"Chunks do arquivo '{file_name}' registrados no tracker (por {peer_name}).")
+        else:
+            print(f"O tracker mantém outra versão de '{file_name}'; a cópia local não foi anunciada.")
     except Exception as e:
         print(f"Erro ao registrar chunks: {e}")
 
@@ -115,10 +186,10 @@ def share_file(file_name, proxy, peer_name):
         print("Apenas arquivos com extensão .txt podem ser compartilhados.")
         return
     try:
-        file_checksum = compute_file_checksum(file_name)
-        chunks = split_file(file_name)
+        chunks, final_checksum, chunk_size = index_file(file_name)
+        share_manifest.save()
         if chunks:
-            register_chunks(proxy, peer_name, file_name, chunks, file_checksum)
+            register_chunks(proxy, peer_name, file_name, chunks, final_checksum, chunk_size)
             print(f"Arquivo '{file_name}' compartilhado com sucesso.")
         else:
             print("Nenhum chunk foi criado.")
@@ -126,17 +197,50 @@ def share_file(file_name, proxy, peer_name):
         print(f"Erro ao compartilhar arquivo: {e}")
 
 def share_all_txt_files(proxy, peer_name):
+    # Arquivos sem alterações desde o último processamento (share_manifest) são anunciados
+    # imediatamente, em um único lote; os novos ou modificados são processados em segundo plano
     files = get_files()
     if not files:
         print("Nenhum arquivo .txt encontrado para compartilhar automaticamente.")
+    share_manifest.prune(files)
+    announcements = []
+    changed = []
     for file in files:
+        if share_manifest.lookup(file) is None:
+            changed.append(file)
+            continue
         try:
-            file_checksum = compute_file_checksum(file)
-            chunks = split_file(file)
+            chunks, final_checksum, chunk_size = index_file(file)
             if chunks:
-                register_chunks(proxy, peer_name, file, chunks, file_checksum)
+                announcements.append([file, chunks, final_checksum, chunk_size,
+                                      share_manifest.previous_checksums(file)])
         except Exception as e:
             print(f"Erro ao compartilhar {file}: {e}")
+    if announcements:
+        try:
+            response = proxy.register_chunks_batch(peer_name, announcements)
+            if is_error(response):
+                print(response)
+            else:
+                print(f"{len(announcements)} arquivo(s) sem alterações anunciados a partir do manifesto.")
+        except Exception as e:
+            print(f"Erro ao registrar chunks: {e}")
+    share_manifest.save()
+    if changed:
+        print(f"Processando {len(changed)} arquivo(s) novo(s) ou modificado(s) em segundo plano...")
+        threading.Thread(target=share_changed_files, args=(proxy, peer_name, changed), daemon=True).start()
+
+def share_changed_files(proxy, peer_name, files):
+    for file in files:
+        if exit_flag.is_set():
+            break
+        try:
+            chunks, final_checksum, chunk_size = index_file(file)
+            if chunks:
+                register_chunks(proxy, peer_name, file, chunks, final_checksum, chunk_size)
+        except Exception as e:
+            print(f"Erro ao compartilhar {file}: {e}")
+    share_manifest.save()
 
 def list_files_from_peers(proxy):
     try:
@@ -147,7 +251,7 @@ def list_files_from_peers(proxy):
         print("\nPeers conectados e arquivos disponíveis:")
         for peer_name, peer_address in peers.items():
             try:
-                with xmlrpc.client.ServerProxy(peer_address) as peer_proxy:
+                with PooledServerProxy(peer_address) as peer_proxy:
                     files = peer_proxy.get_files()
                     print(f"{peer_name}: {files}")
             except Exception as e:
@@ -155,47 +259,12 @@ def list_files_from_peers(proxy):
     except Exception as e:
         print(f"Erro ao listar peers: {e}")
 
-# -------------------------
-# CONEXÕES PERSISTENTES
-# -------------------------
-class PeerConnectionPool:
-    def __init__(self, max_connections=10):
-        self.pool = {}
-        self.max_connections = max_connections
-        self.lock = threading.Lock()
-    def get_connection(self, peer_address):
-        with self.lock:
-            if peer_address not in self.pool:
-                transport = xmlrpc.client.Transport(use_datetime=True)
-                transport.timeout = 30
-                self.pool[peer_address] = xmlrpc.client.ServerProxy(
-                    peer_address, 
-                    transport=transport,
-                    allow_none=True
-                )
-            return self.pool[peer_address]
-
-class TrackerProxy:
-    def __init__(self, address):
-        self.address = address
-        self.semaphore = threading.Semaphore(1)
-        self.transport = xmlrpc.client.Transport(use_datetime=True)
-        self.transport.timeout = 30
-    def get_proxy(self):
-        return xmlrpc.client.ServerProxy(self.address, 
-                                         transport=self.transport,
-                                         allow_none=True)
-    def execute(self, method_name, *args):
-        with self.semaphore:
-            proxy = self.get_proxy()
-            method = getattr(proxy, method_name)
-            return method(*args)
-
 # -------------------------
 # DOWNLOAD DO ARQUIVO COM CONEXÕES PARALELAS
 # -------------------------
 def count_local_chunks():
-    return len([f for f in os.listdir() if '.chunk' in f])
+    # Chunks oferecidos a partir dos arquivos compartilhados mais os baixados em arquivos '.chunkN'
+    return len(chunk_table) + len([f for f in os.listdir() if '.chunk' in f])
 
 def calculate_max_connections():
     num_chunks = count_local_chunks()
@@ -208,136 +277,35 @@ def calculate_max_connections():
     else:
         return 4
 
-def download_file(proxy, local_peer_name):
+def download_file(proxy, local_peer_name, announcer):
     try:
         file_to_get = input("Digite o nome do arquivo que deseja baixar: ").strip()
-        max_connections = calculate_max_connections()
-        print(f"\nBaseado na sua contribuição ({count_local_chunks()} chunks), " 
-              f"você pode usar até {max_connections} conexões paralelas.")
-        while True:
-            try:
-                num_connections = int(input(f"Digite o número de conexões paralelas desejado (1 até {max_connections}): "))
-                if 1 <= num_connections <= max_connections:
-                    break
-                else:
-                    print(f"Por favor, escolha um número entre 1 e {max_connections}.")
-            except ValueError:
-                print(f"Entrada inválida. Digite um número entre 1 e {max_connections}.")
-        tracker = TrackerProxy(TRACKER_ADDRESS)
-        chunks = tracker.execute('get_file_chunks', file_to_get)
-        if not chunks:
-            print(f"Nenhum chunk encontrado para o arquivo '{file_to_get}'.")
-            return
-        final_checksum = tracker.execute('get_file_checksum', file_to_get)
-        if final_checksum == "Checksum não encontrado.":
-            print(f"Checksum final do arquivo '{file_to_get}' não encontrado.")
-            return
-        chunk_to_peers = {}
-        for peer, chunk_id, chunk_name, chunk_checksum in chunks:
-            if peer != local_peer_name:
-                if not os.path.exists(chunk_name):
-                    if chunk_name not in chunk_to_peers:
-                        chunk_to_peers[chunk_name] = []
-                    chunk_to_peers[chunk_name].append((peer, chunk_id, chunk_name, chunk_checksum))
-        if not chunk_to_peers:
-            print(f"Não há chunks para baixar do arquivo '{file_to_get}'. Talvez você já tenha todos os chunks.")
-            return
-        chunks_to_download = []
-        for chunk_name, peer_list in chunk_to_peers.items():
-            selected_peer = random.choice(peer_list)
-            chunks_to_download.append(selected_peer)
-        random.shuffle(chunks_to_download)
-        start_time = time.time()
-        downloaded_chunks = set()
-        in_progress_chunks = set()
-        chunk_locks = {chunk[2]: threading.Lock() for chunk in chunks_to_download}
-        downloaded_lock = threading.Lock()
-        in_progress_lock = threading.Lock()
-        active_workers = threading.Semaphore(num_connections)
-        chunks_queue = queue.Queue()
-        for chunk in chunks_to_download:
-            chunks_queue.put(chunk)
-        failed_chunks = queue.Queue()
-        def worker():
+        if CONTRIBUTION_POLICY:
+            max_connections = calculate_max_connections()
+            print(f"\nBaseado na sua contribuição ({count_local_chunks()} chunks), " 
+                  f"você pode usar até {max_connections} conexões paralelas.")
             while True:
-                with active_workers:
-                    try:
-                        chunk_info = chunks_queue.get_nowait()
-                    except queue.Empty:
+                try:
+                    num_connections = int(input(f"Digite o número de conexões paralelas desejado (1 até {max_connections}): "))
+                    if 1 <= num_connections <= max_connections:
                         break
-                    peer, chunk_id, chunk_name, chunk_checksum = chunk_info
-                    with in_progress_lock:
-                        if chunk_name in in_progress_chunks:
-                            chunks_queue.task_done()
-                            continue
-                        in_progress_chunks.add(chunk_name)
-                    try:
-                        with downloaded_lock:
-                            if chunk_name in downloaded_chunks:
-                                chunks_queue.task_done()
-                                continue
-                        peer_addr = tracker.execute('get_peer_address', peer)
-                        if peer_addr == "Peer não encontrado.":
-                            failed_chunks.put((chunk_name, "Peer não encontrado"))
-                            continue
-                        peer_proxy = PeerConnectionPool().get_connection(peer_addr)
-                        print(f"Baixando {chunk_name} de {peer}...")
-                        response = peer_proxy.send_chunk(chunk_name)
-                        if isinstance(response, xmlrpc.client.Binary):
-                            data = response.data
-                            if chunk_checksum:
-                                downloaded_checksum = calculate_checksum(data)
-                                if downloaded_checksum != chunk_checksum:
-                                    failed_chunks.put((chunk_name, "Checksum inválido"))
-                                    continue
-                            with chunk_locks[chunk_name]:
-                                with open(chunk_name, "wb") as f:
-                                    f.write(data)
-                            tracker.execute('register_chunks', local_peer_name, file_to_get,
-                                         [(chunk_id, chunk_name, chunk_checksum)],
-                                         final_checksum)
-                            with downloaded_lock:
-                                downloaded_chunks.add(chunk_name)
-                        else:
-                            failed_chunks.put((chunk_name, response))
-                    except Exception as e:
-                        failed_chunks.put((chunk_name, str(e)))
-                    finally:
-                        with in_progress_lock:
-                            in_progress_chunks.discard(chunk_name)
-                        chunks_queue.task_done()
-        threads = []
-        for _ in range(num_connections):
-            thread = threading.Thread(target=worker)
-            thread.daemon = True
-            thread.start()
-            threads.append(thread)
-        chunks_queue.join()
-        end_time = time.time()
-        duration = end_time - start_time
-        if not failed_chunks.empty():
-            print("\nFalhas no download:")
-            while not failed_chunks.empty():
-                chunk_name, error = failed_chunks.get()
-                print(f"- {chunk_name}: {error}")
-            return
-        print("\nReagrupando o arquivo...")
-        assemble_file(file_to_get)
-        assembled_file = f"{file_to_get}.assembled"
-        with open(assembled_file, "rb") as f:
-            assembled_checksum = calculate_checksum(f.read())
-        if assembled_checksum == final_checksum:
-            print("Arquivo baixado com sucesso e checksum verificado!")
-            if not os.path.exists(file_to_get):
-                os.rename(assembled_file, file_to_get)
-            else:
-                os.remove(assembled_file)
-            local_chunks = split_file(file_to_get)
-            tracker.execute('register_chunks', local_peer_name, file_to_get, local_chunks, final_checksum)
+                    else:
+                        print(f"Por favor, escolha um número entre 1 e {max_connections}.")
+                except ValueError:
+                    print(f"Entrada inválida. Digite um número entre 1 e {max_connections}.")
         else:
-            print("Erro: checksum do arquivo final não confere!")
-            os.remove(assembled_file)
-        print(f"\nTempo de transferência para {num_connections} conexões: {duration:.2f} segundos")
+            num_connections = MAX_IN_FLIGHT
+            print(f"\nConexões paralelas ajustadas automaticamente (até {num_connections}).")
+        # Fluxo de download comum com o peer.py: plano conferido, motor asyncio, verificação e anúncio
+        downloader = FileDownloader(proxy, local_peer_name, announcer, chunk_table, share_manifest, share_ranges,
+                                    local_file_checksum, HASH_WORKERS)
+        plan = downloader.load_plan(file_to_get)
+        if plan is None:
+            return
+        start_time = time.time()
+        downloader.download(plan, num_connections)
+        duration = time.time() - start_time
+        print(f"\nTempo de transferência com até {num_connections} conexões: {duration:.2f} segundos")
     except Exception as e:
         print(f"Erro durante o download: {e}")
 
@@ -349,14 +317,10 @@ def send_heartbeat(proxy, name):
     max_failures = 3
     while not exit_flag.is_set():
         try:
-            transport = xmlrpc.client.Transport(use_datetime=True)
-            transport.timeout = 10
-            with xmlrpc.client.ServerProxy(TRACKER_ADDRESS, 
-                                         transport=transport,
-                                         allow_none=True) as temp_proxy:
-                temp_proxy.heartbeat(name)
-                failures = 0
-                time.sleep(5)
+            # O proxy reaproveita a conexão persistente com o tracker
+            proxy.heartbeat(name)
+            failures = 0
+            time.sleep(5)
         except Exception as e:
             failures += 1
             if failures >= max_failures:
@@ -366,31 +330,39 @@ def send_heartbeat(proxy, name):
             time.sleep(2)
 
 def connect_to_tracker(name):
-    transport = xmlrpc.client.Transport(use_datetime=True)
-    transport.timeout = 10
     try:
-        proxy = xmlrpc.client.ServerProxy(TRACKER_ADDRESS, 
-                                        transport=transport,
-                                        allow_none=True)
+        # Proxy seguro entre threads: cada chamada usa uma conexão persistente do pool,
+        # no shard do tracker responsável pelo arquivo
+        tracker_addresses = TRACKER_ADDRESSES or [TRACKER_ADDRESS]
+        proxy = ShardedTracker(tracker_addresses)
         local_ip = get_local_ip()
-        response = proxy.register(name, f"http://{local_ip}:{PORT}")
+        peer_address = f"http://{local_ip}:{PORT}"
+        response = proxy.register(name, peer_address)
         if response.startswith("Error:"):
             print(response)
             return False
         print(response)
         # Compartilha arquivos existentes
         share_all_txt_files(proxy, name)
+        # Fila que anuncia em lote os chunks baixados
+        announcer = ChunkAnnouncer(tracker_addresses, name, peer_address=peer_address)
         # Inicia thread de heartbeat
         heartbeat_thread = threading.Thread(target=send_heartbeat, 
                                          args=(proxy, name),
                                          daemon=True)
         heartbeat_thread.start()
+        # Inicia o canal de dados usado para transferir os chunks
+        global data_server
+        data_server = ChunkDataServer('0.0.0.0', chunk_table.resolve, limiter=upload_limiter,
+                                      cache=chunk_table.cache)
+        data_server.start()
         # Inicia servidor local para receber requisições de outros peers
-        server = SimpleXMLRPCServer(('0.0.0.0', PORT), 
+        server = ThreadedXMLRPCServer(('0.0.0.0', PORT), 
                                   allow_none=True,
                                   logRequests=False)
         server.timeout = 10
         server.register_function(send_chunk, 'send_chunk')
+        server.register_function(get_data_port, 'get_data_port')
         server.register_function(get_files, 'get_files')
         server.register_function(receive_message, 'receive_message')
         server_thread = threading.Thread(target=server.serve_forever, 
@@ -404,7 +376,8 @@ def connect_to_tracker(name):
                     "\nDigite 'list' para ver peers, 'chunks' para ver blocos de um arquivo,\n"
                     "'chat' para conversar, 'get' para baixar um arquivo completo,\n"
                     "'assemble' para reconstituir um arquivo (se necessário),\n"
-                    "'share' para compartilhar um novo arquivo, 'exit' para sair: "
+                    "'share' para compartilhar um novo arquivo, 'stats' para ver os uploads,\n"
+                    "'exit' para sair: "
                 ).strip().lower()
                 if command == 'list':
                     list_files_from_peers(proxy)
@@ -426,16 +399,19 @@ def connect_to_tracker(name):
                     else:
                         send_message(peer_name_input, peer_address, name)
                 elif command == 'get':
-                    download_file(proxy, name)
+                    download_file(proxy, name, announcer)
                 elif command == 'assemble':
                     original_file = input("Digite o nome original do arquivo: ").strip()
                     assemble_file(original_file)
                 elif command == 'share':
                     file_to_share = input("Digite o nome do arquivo .txt para compartilhar: ").strip()
                     share_file(file_to_share, proxy, name)
+                elif command == 'stats':
+                    print_upload_stats(upload_limiter, chunk_table.cache)
                 elif command == 'exit':
                     print("Saindo...")
                     exit_flag.set()
+                    announcer.close()
                     break
                 else:
                     print("Comando inválido. Tente novamente.")
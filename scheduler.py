@@ -0,0 +1,369 @@
+from collections import deque
+import threading
+import random
+import heapq
+import time
+
+from transfer import TransferCancelled
+
+# Peso da amostra mais recente na média móvel de vazão de cada peer
+THROUGHPUT_ALPHA = 0.3
+# Quantidade de chunks restantes a partir da qual o download entra no modo endgame
+ENDGAME_CHUNKS = 4
+# Percentil da duração das requisições a partir do qual uma requisição é considerada lenta
+HEDGE_PERCENTILE = 0.95
+# Número mínimo de amostras de duração antes de usar o percentil
+HEDGE_MIN_SAMPLES = 5
+# Rodadas de tentativas em todos os peers antes de desistir de um chunk
+MAX_ROUNDS = 3
+# Espera (em segundos) antes de uma nova rodada de tentativas, multiplicada pela rodada
+RETRY_DELAY = 1.0
+# Limite padrão de requisições simultâneas de um download (somando todos os peers)
+MAX_IN_FLIGHT = 32
+
+class ConcurrencyController:
+    """
+    Controle adaptativo (AIMD) do número de requisições simultâneas por peer.
+    A janela de cada peer cresce de forma aditiva (cerca de +1 a cada janela de chunks
+    concluídos) enquanto a vazão agregada do peer continuar aumentando, e cai pela metade
+    a cada erro. O total de requisições de todos os peers é limitado por `max_total`.
+    """
+    def __init__(self, max_total=MAX_IN_FLIGHT, initial=2, minimum=1, maximum=16):
+        self.max_total = max_total
+        self.initial = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.windows = {}
+        self.best_goodput = {}
+
+    def window(self, peer):
+        return int(self.windows.get(peer, self.initial))
+
+    def on_success(self, peer, goodput):
+        """ `goodput`: vazão agregada (bytes/s) observada no peer com a janela atual """
+        window = self.windows.get(peer, self.initial)
+        best = self.best_goodput.get(peer, 0)
+        if goodput >= 0.95 * best:
+            # A vazão ainda cresce com mais requisições: aumento aditivo
+            window = min(self.maximum, window + 1 / window)
+        else:
+            # Mais requisições não trouxeram ganho: recua devagar
+            window = max(self.minimum, window - 0.5 / window)
+        self.best_goodput[peer] = max(goodput, 0.9 * best)
+        self.windows[peer] = window
+
+    def on_failure(self, peer):
+        """ Erro ou timeout: redução multiplicativa """
+        self.windows[peer] = max(self.minimum, self.windows.get(peer, self.initial) / 2)
+
+class GuardedOutput:
+    """
+    Encaminha as escritas de uma requisição para o arquivo parcial enquanto o chunk ainda não
+    foi concluído por outra requisição; depois disso, a transferência é cancelada.
+    """
+    def __init__(self, scheduler, chunk_id, output):
+        self.scheduler = scheduler
+        self.chunk_id = chunk_id
+        self.output = output
+
+    def write_at(self, offset, data):
+        with self.scheduler.chunk_locks[self.chunk_id]:
+            if self.scheduler.is_done(self.chunk_id):
+                raise TransferCancelled()
+            self.output.write_at(offset, data)
+
+class PieceScheduler:
+    """
+    Escalonador de chunks de um download.
+    Os chunks são entregues do mais raro (menos peers o possuem) para o mais comum, e cada um
+    é atribuído ao peer com menor tempo estimado de conclusão, considerando as requisições
+    em andamento e a vazão observada de cada peer.
+    Quando restam poucos chunks (endgame), ou quando uma requisição passa do percentil de
+    duração observado, o mesmo chunk também é pedido a outro peer que o possua: a primeira
+    cópia verificada é mantida e as demais são canceladas. Chunks que falham são pedidos
+    novamente a outros peers, por até MAX_ROUNDS rodadas.
+    O número de requisições simultâneas por peer e no total é limitado pelo `controller`.
+    Cada peer tem a sua fila de chunks prontos, e só as filas dos peers com espaço na janela
+    são consultadas: o custo de cada requisição não depende do número de chunks na fila.
+    `on_change`, se definido, é chamado quando fontes novas tornam requisições possíveis fora
+    das conclusões e falhas (por exemplo, para acordar o motor de download).
+    `chunks` é a lista de chunks do plano de download ({chunk_id, chunk_name, checksum, peers}).
+    """
+    def __init__(self, chunks, local_peer_name, chunk_size, controller=None):
+        self.local_peer_name = local_peer_name
+        self.chunk_size = chunk_size
+        self.controller = controller if controller is not None else ConcurrencyController()
+        self.on_change = None
+        self.chunks = {}
+        # Todos os chunks do plano, inclusive os que falharam, para que possam voltar à fila
+        self.plan = {}
+        self.holders = {}
+        self.tried = {}
+        self.rounds = {}
+        self.chunk_locks = {}
+        # peer -> heap de (número de peers do chunk, desempate, chunk_id) dos chunks prontos.
+        # As entradas de chunks concluídos ou em andamento são descartadas ao chegar ao topo.
+        self.ready = {}
+        self.delayed = []
+        # chunk_id -> {peer: instante de início} das requisições em andamento
+        self.in_flight = {}
+        self.done = set()
+        self.failed = {}
+        self.outstanding = {}
+        self.throughput = {}
+        self.durations = deque(maxlen=200)
+        self.lock = threading.Lock()
+        for chunk in chunks:
+            chunk_id = chunk["chunk_id"]
+            self.chunks[chunk_id] = chunk
+            self.plan[chunk_id] = chunk
+            self.holders[chunk_id] = [peer for peer in chunk["peers"] if peer != local_peer_name]
+            self.tried[chunk_id] = set()
+            self.rounds[chunk_id] = 0
+            self.chunk_locks[chunk_id] = threading.Lock()
+            self._push(chunk_id)
+
+    def _candidates(self, chunk_id):
+        """ Peers do chunk que ainda não falharam nesta rodada """
+        return [peer for peer in self.holders[chunk_id] if peer not in self.tried[chunk_id]]
+
+    def _push(self, chunk_id, peers=None):
+        """
+        Coloca o chunk na fila de cada peer candidato (ou só dos `peers` informados); sem nenhum
+        candidato, o chunk falha (requer lock)
+        """
+        candidates = self._candidates(chunk_id)
+        if not candidates:
+            self.failed[chunk_id] = "Nenhum peer disponível"
+            del self.chunks[chunk_id]
+            return
+        # O desempate aleatório evita que todos os downloaders peçam os mesmos chunks ao mesmo tempo
+        entry = (len(self.holders[chunk_id]), random.random(), chunk_id)
+        for peer in peers if peers is not None else candidates:
+            heapq.heappush(self.ready.setdefault(peer, []), entry)
+
+    def _ready_entry(self, peer):
+        """ Entrada do chunk mais prioritário que o peer pode atender agora, ou None (requer lock) """
+        queue = self.ready.get(peer)
+        while queue:
+            chunk_id = queue[0][2]
+            if (chunk_id in self.chunks and chunk_id not in self.in_flight
+                    and peer in self.holders[chunk_id] and peer not in self.tried[chunk_id]):
+                return queue[0]
+            heapq.heappop(queue)
+        return None
+
+    def _estimated_time(self, peer):
+        """ Tempo estimado para o peer entregar mais um chunk, dadas as requisições pendentes """
+        known = [rate for rate in self.throughput.values() if rate > 0]
+        rate = self.throughput.get(peer) or (sum(known) / len(known) if known else 1.0)
+        return (self.outstanding.get(peer, 0) + 1) * self.chunk_size / rate
+
+    def _pick_peer(self, candidates):
+        return min(candidates, key=lambda p: (self._estimated_time(p), random.random()))
+
+    def _available(self, candidates):
+        """ Peers que ainda têm espaço na sua janela de requisições, respeitando o limite total """
+        if sum(self.outstanding.values()) >= self.controller.max_total:
+            return []
+        return [peer for peer in candidates if self.outstanding.get(peer, 0) < self.controller.window(peer)]
+
+    def _start(self, chunk_id, peer):
+        self.in_flight.setdefault(chunk_id, {})[peer] = time.time()
+        self.outstanding[peer] = self.outstanding.get(peer, 0) + 1
+
+    def _release(self, chunk_id, peer):
+        """ Encerra uma requisição e retorna o instante em que ela começou """
+        requests = self.in_flight.get(chunk_id, {})
+        started = requests.pop(peer, time.time())
+        if not requests:
+            self.in_flight.pop(chunk_id, None)
+        self.outstanding[peer] = max(0, self.outstanding.get(peer, 0) - 1)
+        return started
+
+    def _next_queued(self):
+        now = time.time()
+        while self.delayed and self.delayed[0][0] <= now:
+            _, chunk_id = heapq.heappop(self.delayed)
+            if chunk_id in self.chunks:
+                self._push(chunk_id)
+        # Só as filas dos peers com espaço na janela são consultadas
+        best = None
+        for peer in self._available(list(self.ready)):
+            entry = self._ready_entry(peer)
+            if entry is not None and (best is None or entry < best):
+                best = entry
+        if best is None:
+            return None
+        chunk_id = best[2]
+        peer = self._pick_peer(self._available(self._candidates(chunk_id)))
+        self._start(chunk_id, peer)
+        return self.chunks[chunk_id], peer
+
+    def _latency_threshold(self):
+        """ Duração a partir da qual uma requisição é considerada lenta (None se ainda não há amostras) """
+        if len(self.durations) < HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self.durations)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * HEDGE_PERCENTILE))]
+
+    def _next_hedge(self):
+        """ Escolhe um chunk em andamento para ser pedido também a outro peer (requisição duplicada) """
+        now = time.time()
+        endgame = len(self.chunks) <= ENDGAME_CHUNKS
+        threshold = self._latency_threshold()
+        best = None
+        for chunk_id, requests in self.in_flight.items():
+            if chunk_id not in self.chunks:
+                # Chunk já concluído; a requisição restante está sendo cancelada
+                continue
+            oldest = min(requests.values())
+            if not endgame and (threshold is None or now - oldest < threshold):
+                continue
+            candidates = self._available([peer for peer in self.holders[chunk_id]
+                                          if peer not in requests and peer not in self.tried[chunk_id]])
+            if candidates and (best is None or oldest < best[0]):
+                best = (oldest, chunk_id, candidates)
+        if best is None:
+            return None
+        _, chunk_id, candidates = best
+        peer = self._pick_peer(candidates)
+        self._start(chunk_id, peer)
+        return self.chunks[chunk_id], peer
+
+    def _poll(self):
+        """ Próxima requisição disponível agora, ou None (requer lock) """
+        request = self._next_queued()
+        if request is not None:
+            return request + (False,)
+        if self.chunks:
+            request = self._next_hedge()
+            if request is not None:
+                return request + (True,)
+        return None
+
+    def next_timeout(self):
+        """
+        Segundos até o próximo evento que depende só do tempo: uma nova rodada de tentativas ou
+        uma requisição em andamento que passa do percentil de duração. None se não houver nenhum;
+        os demais eventos (conclusões, falhas, fontes novas) acordam o motor diretamente.
+        """
+        with self.lock:
+            now = time.time()
+            deadlines = [self.delayed[0][0]] if self.delayed else []
+            threshold = self._latency_threshold()
+            if threshold is not None:
+                deadlines += [min(requests.values()) + threshold for chunk_id, requests in self.in_flight.items()
+                              if chunk_id in self.chunks]
+            # Prazos já vencidos dependem de uma janela livre ou de um peer novo, e não do tempo
+            deadlines = [deadline for deadline in deadlines if deadline > now]
+            return min(deadlines) - now if deadlines else None
+
+    def poll_request(self):
+        """
+        Retorna a próxima requisição (chunk, peer, duplicada) disponível agora, sem esperar:
+        um chunk da fila ou a duplicata de um chunk lento. Retorna None se não houver nenhuma;
+        use finished() para saber se o download terminou.
+        """
+        with self.lock:
+            return self._poll()
+
+    def finished(self):
+        with self.lock:
+            return not self.chunks
+
+    def update_holders(self, added=(), removed=()):
+        """
+        Atualiza as fontes dos chunks durante o download, com pares (peer, chunk_id) que passaram
+        a ter ou deixaram de ter o chunk. Um chunk que falhou por falta de peers volta para a fila
+        quando ganha uma fonte nova; requisições em andamento não são afetadas.
+        Retorna quantas fontes novas foram incluídas.
+        """
+        count = 0
+        lost = False
+        with self.lock:
+            for peer, chunk_id in removed:
+                holders = self.holders.get(chunk_id)
+                if holders is not None and peer in holders:
+                    holders.remove(peer)
+                    if chunk_id in self.chunks and chunk_id not in self.in_flight and not self._candidates(chunk_id):
+                        # Nenhum peer restante pode atender o chunk
+                        self.failed[chunk_id] = "Nenhum peer disponível"
+                        del self.chunks[chunk_id]
+                        lost = True
+            for peer, chunk_id in added:
+                holders = self.holders.get(chunk_id)
+                if holders is None or peer == self.local_peer_name or peer in holders or chunk_id in self.done:
+                    continue
+                holders.append(peer)
+                self.tried[chunk_id].discard(peer)
+                count += 1
+                if chunk_id in self.failed:
+                    del self.failed[chunk_id]
+                    self.chunks[chunk_id] = self.plan[chunk_id]
+                    self.rounds[chunk_id] = 0
+                    self._push(chunk_id)
+                elif chunk_id in self.chunks:
+                    # O chunk já está nas filas dos outros peers; basta incluí-lo na do novo
+                    self._push(chunk_id, [peer])
+        if (count or lost) and self.on_change is not None:
+            self.on_change()
+        return count
+
+    def is_done(self, chunk_id):
+        return chunk_id in self.done
+
+    def output_for(self, chunk_id, output):
+        """ Destino protegido para a requisição principal de um chunk """
+        return GuardedOutput(self, chunk_id, output)
+
+    def complete(self, chunk_id, peer, length, output=None, offset=None, data=None):
+        """
+        Registra a conclusão verificada de um chunk e atualiza a vazão observada do peer.
+        Requisições duplicadas informam `output`, `offset` e `data` para que a cópia só seja
+        gravada se o chunk ainda não tiver sido concluído.
+        Retorna True se esta requisição foi a primeira a concluir o chunk.
+        """
+        with self.chunk_locks[chunk_id]:
+            first = chunk_id not in self.done
+            if first and data is not None:
+                output.write_at(offset, data)
+            with self.lock:
+                concurrent = max(1, self.outstanding.get(peer, 1))
+                started = self._release(chunk_id, peer)
+                elapsed = max(time.time() - started, 1e-6)
+                self.durations.append(elapsed)
+                rate = length / elapsed
+                previous = self.throughput.get(peer)
+                self.throughput[peer] = rate if previous is None else (
+                    THROUGHPUT_ALPHA * rate + (1 - THROUGHPUT_ALPHA) * previous)
+                # Vazão agregada do peer: vazão por requisição vezes as requisições simultâneas
+                self.controller.on_success(peer, self.throughput[peer] * concurrent)
+                self.done.add(chunk_id)
+                self.chunks.pop(chunk_id, None)
+        return first
+
+    def fail(self, chunk_id, peer, error):
+        """
+        Registra uma falha. Se nenhuma outra requisição do chunk estiver em andamento, ele volta
+        para a fila para ser pedido a outro peer; após tentar todos os peers, começa uma nova
+        rodada com espera crescente, até MAX_ROUNDS.
+        """
+        with self.lock:
+            self._release(chunk_id, peer)
+            if chunk_id in self.done or chunk_id not in self.chunks:
+                return
+            self.controller.on_failure(peer)
+            self.tried[chunk_id].add(peer)
+            if chunk_id in self.in_flight:
+                return
+            if all(holder in self.tried[chunk_id] for holder in self.holders[chunk_id]):
+                self.rounds[chunk_id] += 1
+                if self.rounds[chunk_id] >= MAX_ROUNDS:
+                    self.failed[chunk_id] = error
+                    del self.chunks[chunk_id]
+                    return
+                self.tried[chunk_id] = set()
+                heapq.heappush(self.delayed, (time.time() + RETRY_DELAY * self.rounds[chunk_id], chunk_id))
+            else:
+                self._push(chunk_id)
@@ -0,0 +1,370 @@
+import threading
+import hashlib
+import struct
+import json
+import os
+
+from transfer import resolve_chunk_file, CONTENT_PREFIX
+from compression import compress, range_encoding
+
+def read_range(path, offset, length):
+    """ Lê `length` bytes de `path` a partir de `offset` sem alterar a posição de outros leitores """
+    with open(path, "rb") as f:
+        if hasattr(os, "pread"):
+            return os.pread(f.fileno(), length, offset)
+        f.seek(offset)
+        return f.read(length)
+
+class ChunkTable:
+    """
+    Tabela local dos chunks oferecidos pelo peer: chunk_name -> (caminho, offset, tamanho).
+    Permite servir o chunk i como um intervalo de bytes do arquivo original,
+    sem gravar arquivos '.chunkN' separados no disco.
+    Os chunks também são indexados pelo checksum, para atender pedidos "sha256:<checksum>"
+    e reaproveitar conteúdo repetido entre arquivos e versões.
+    Se `cache` (cache.ChunkCache) for informado, os chunks lidos ficam em memória.
+    """
+    def __init__(self, cache=None):
+        self.entries = {}
+        self.checksums = {}
+        # checksum -> set(chunk_name)
+        self.by_checksum = {}
+        self.cache = cache
+        self.lock = threading.Lock()
+
+    def add(self, chunk_name, path, offset, length, checksum=None):
+        with self.lock:
+            self._forget_checksum(chunk_name)
+            self.entries[chunk_name] = (path, offset, length)
+            if checksum is not None:
+                self.checksums[chunk_name] = checksum
+                self.by_checksum.setdefault(checksum, set()).add(chunk_name)
+        if self.cache is not None:
+            # O conteúdo nessa posição pode ter mudado (arquivo compartilhado novamente)
+            self.cache.discard((path, offset, length))
+
+    def remove_file(self, path):
+        """ Remove todos os chunks que apontam para `path` """
+        with self.lock:
+            for chunk_name in [name for name, entry in self.entries.items() if entry[0] == path]:
+                self._forget_checksum(chunk_name)
+                del self.entries[chunk_name]
+        if self.cache is not None:
+            self.cache.discard_path(path)
+
+    def _forget_checksum(self, chunk_name):
+        """ Remove um chunk do índice por checksum (requer lock) """
+        checksum = self.checksums.pop(chunk_name, None)
+        if checksum is not None:
+            names = self.by_checksum[checksum]
+            names.discard(chunk_name)
+            if not names:
+                del self.by_checksum[checksum]
+
+    def find(self, checksum):
+        """ Retorna (caminho, offset, tamanho) de um chunk local com esse checksum, ou None """
+        with self.lock:
+            locations = [self.entries[name] for name in self.by_checksum.get(checksum, ())]
+        for location in locations:
+            if os.path.exists(location[0]):
+                return location
+        return None
+
+    def resolve(self, chunk_name):
+        """
+        Retorna (caminho, offset, tamanho) do chunk ou None se ele não estiver disponível.
+        Chunks fora da tabela são procurados como arquivos '.chunkN' no diretório.
+        """
+        if chunk_name.startswith(CONTENT_PREFIX):
+            return self.find(chunk_name[len(CONTENT_PREFIX):])
+        with self.lock:
+            location = self.entries.get(chunk_name)
+        if location is not None and os.path.exists(location[0]):
+            return location
+        return resolve_chunk_file(chunk_name)
+
+    def read(self, chunk_name):
+        """ Lê os bytes de um chunk; lança FileNotFoundError se ele não estiver disponível """
+        return self.read_payload(chunk_name)[0]
+
+    def read_payload(self, chunk_name, encoding=None):
+        """
+        Retorna (bytes do chunk, compressão usada, tamanho original): `encoding` só é usada se
+        compensar para este chunk. Lança FileNotFoundError se o chunk não estiver disponível.
+        """
+        location = self.resolve(chunk_name)
+        if location is None:
+            raise FileNotFoundError(chunk_name)
+        encoding = range_encoding(encoding, *location)
+        if self.cache is not None:
+            data = self.cache.payload(location, encoding)
+            if data is not None:
+                return data, encoding, location[2]
+        return compress(encoding, read_range(*location)), encoding, location[2]
+
+    def __len__(self):
+        with self.lock:
+            return len(self.entries)
+
+class PartialFile:
+    """
+    Arquivo de destino de um download, pré-alocado com o tamanho esperado.
+    Cada chunk é gravado diretamente na sua posição (escrita posicional, segura entre threads),
+    e ao final basta truncar para o tamanho real e renomear para o nome definitivo.
+    """
+    def __init__(self, file_name, size):
+        self.file_name = file_name
+        self.path = f"{file_name}.download"
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0), 0o644)
+        self.lock = threading.Lock()
+        if os.fstat(self.fd).st_size < size:
+            if hasattr(os, "posix_fallocate"):
+                try:
+                    os.posix_fallocate(self.fd, 0, size)
+                except OSError:
+                    os.ftruncate(self.fd, size)
+            else:
+                os.ftruncate(self.fd, size)
+
+    def write_at(self, offset, data):
+        """ Grava `data` na posição `offset` do arquivo """
+        if hasattr(os, "pwrite"):
+            view = memoryview(data)
+            while view:
+                written = os.pwrite(self.fd, view, offset)
+                view = view[written:]
+                offset += written
+        else:
+            with self.lock:
+                os.lseek(self.fd, offset, os.SEEK_SET)
+                os.write(self.fd, data)
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def finish(self, size):
+        """ Ajusta o arquivo para o tamanho final e o fecha """
+        os.ftruncate(self.fd, size)
+        self.close()
+
+    def commit(self):
+        """ Renomeia o arquivo concluído para o nome definitivo """
+        os.replace(self.path, self.file_name)
+        return self.file_name
+
+    def discard(self):
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+class ChunkBuffer:
+    """ Destino em memória para um chunk, usado pelas requisições duplicadas do modo endgame """
+    def __init__(self):
+        self.data = bytearray()
+
+    def write_at(self, offset, data):
+        end = offset + len(data)
+        if len(self.data) < end:
+            self.data.extend(bytes(end - len(self.data)))
+        self.data[offset:end] = data
+
+class DownloadState:
+    """
+    Estado persistente de um download, usado para retomá-lo após uma interrupção.
+    O arquivo '{arquivo}.download.state' contém uma linha JSON com o checksum final e os
+    checksums esperados dos chunks, 8 bytes com o tamanho final do arquivo (0 enquanto
+    desconhecido) e um bitfield dos chunks já verificados. O arquivo é criado de forma atômica
+    e cada chunk concluído altera apenas o byte correspondente do bitfield.
+    `layout` ([(offset, tamanho)] por chunk) descreve chunks de tamanho variável (divisão pelo
+    conteúdo); sem ele, o chunk i começa em i * chunk_size.
+    """
+    def __init__(self, file_name, file_checksum, chunk_size, checksums, bitfield=None, file_size=0, layout=None):
+        self.file_name = file_name
+        self.path = f"{file_name}.download.state"
+        self.file_checksum = file_checksum
+        self.chunk_size = chunk_size
+        self.checksums = list(checksums)
+        self.layout = [tuple(entry) for entry in layout] if layout is not None else None
+        self.bitfield = bitfield if bitfield is not None else bytearray((len(self.checksums) + 7) // 8)
+        if self.layout is not None:
+            file_size = sum(length for _, length in self.layout)
+        self.file_size = file_size
+        self.fd = None
+        self.header_length = 0
+        self.lock = threading.Lock()
+
+    @classmethod
+    def load(cls, file_name):
+        """ Carrega o estado salvo de um download, ou retorna None se não houver um válido """
+        path = f"{file_name}.download.state"
+        try:
+            with open(path, "rb") as f:
+                header = json.loads(f.readline().decode("utf-8"))
+                (file_size,) = struct.unpack(">Q", f.read(8))
+                bitfield = bytearray(f.read())
+        except (OSError, ValueError, struct.error):
+            return None
+        state = cls(file_name, header["file_checksum"], header["chunk_size"], header["checksums"],
+                    bitfield, file_size, header.get("layout"))
+        if len(bitfield) != (len(state.checksums) + 7) // 8:
+            return None
+        return state
+
+    def matches(self, file_checksum, chunk_size, checksums, layout=None):
+        """ Indica se o estado salvo corresponde ao mesmo arquivo anunciado pelo tracker """
+        if layout is not None:
+            layout = [tuple(entry) for entry in layout]
+        return (self.file_checksum == file_checksum and self.chunk_size == chunk_size
+                and len(self.checksums) == len(checksums) and self.layout == layout)
+
+    def update_checksums(self, checksums):
+        """ Completa os checksums que eram desconhecidos; chunks com checksum diferente voltam a faltar """
+        for index, checksum in enumerate(checksums):
+            if checksum is not None and checksum != self.checksums[index]:
+                self.checksums[index] = checksum
+                self.set_done(index, False)
+
+    def save(self):
+        """ Grava o estado completo de forma atômica e o mantém aberto para as atualizações """
+        header = json.dumps({
+            "file_checksum": self.file_checksum,
+            "chunk_size": self.chunk_size,
+            "checksums": self.checksums,
+            "layout": self.layout,
+        }).encode("utf-8") + b"\n"
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(header)
+            f.write(struct.pack(">Q", self.file_size))
+            f.write(self.bitfield)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+        self.close()
+        self.header_length = len(header)
+        self.fd = os.open(self.path, os.O_RDWR | getattr(os, "O_BINARY", 0))
+
+    def _write_at(self, offset, data):
+        if hasattr(os, "pwrite"):
+            os.pwrite(self.fd, data, offset)
+        else:
+            os.lseek(self.fd, offset, os.SEEK_SET)
+            os.write(self.fd, data)
+
+    def is_done(self, index):
+        return bool(self.bitfield[index // 8] & (0x80 >> (index % 8)))
+
+    def set_done(self, index, done):
+        """ Altera um bit do bitfield em memória e no disco """
+        with self.lock:
+            byte = index // 8
+            if done:
+                self.bitfield[byte] |= 0x80 >> (index % 8)
+            else:
+                self.bitfield[byte] &= ~(0x80 >> (index % 8)) & 0xFF
+            if self.fd is not None:
+                self._write_at(self.header_length + 8 + byte, bytes([self.bitfield[byte]]))
+
+    def mark_done(self, index, length):
+        """ Marca um chunk como verificado; o último chunk também define o tamanho final do arquivo """
+        if index == len(self.checksums) - 1 and self.layout is None:
+            with self.lock:
+                self.file_size = index * self.chunk_size + length
+                if self.fd is not None:
+                    self._write_at(self.header_length, struct.pack(">Q", self.file_size))
+        self.set_done(index, True)
+
+    def done_count(self):
+        return sum(self.is_done(i) for i in range(len(self.checksums)))
+
+    def chunk_offset(self, index):
+        if self.layout is not None:
+            return self.layout[index][0]
+        return index * self.chunk_size
+
+    def chunk_length(self, index):
+        if self.layout is not None:
+            return self.layout[index][1]
+        if index == len(self.checksums) - 1:
+            return self.file_size - index * self.chunk_size
+        return self.chunk_size
+
+    def verify(self, path):
+        """
+        Relê do arquivo parcial os chunks marcados como concluídos e desmarca
+        os que estiverem ausentes, truncados ou corrompidos. Retorna quantos continuam válidos.
+        """
+        for index, checksum in enumerate(self.checksums):
+            if not self.is_done(index):
+                continue
+            length = self.chunk_length(index)
+            try:
+                data = read_range(path, self.chunk_offset(index), length) if length > 0 else b""
+                valid = length > 0 and len(data) == length and hashlib.sha256(data).hexdigest() == checksum
+            except OSError:
+                valid = False
+            if not valid:
+                self.set_done(index, False)
+        return self.done_count()
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def remove(self):
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+def open_download(file_name, file_checksum, chunk_size, checksums, layout=None):
+    """
+    Prepara o arquivo parcial e o estado persistente de um download.
+    Se existir um download interrompido do mesmo arquivo, ele é retomado: os chunks já marcados
+    são verificados novamente e só os ausentes ou inválidos precisarão ser baixados.
+    `checksums` é indexado pelo chunk_id; `layout` ([(offset, tamanho)]) é informado quando os
+    chunks têm tamanho variável. Retorna (state, partial).
+    """
+    state = DownloadState.load(file_name)
+    partial_path = f"{file_name}.download"
+    if (state is not None and state.matches(file_checksum, chunk_size, checksums, layout)
+            and os.path.exists(partial_path)):
+        state.update_checksums(checksums)
+        state.save()
+        state.verify(partial_path)
+    else:
+        if state is not None:
+            state.remove()
+        state = DownloadState(file_name, file_checksum, chunk_size, checksums, layout=layout)
+        state.save()
+    size = state.file_size if layout is not None else len(checksums) * chunk_size
+    partial = PartialFile(file_name, size)
+    return state, partial
+
+def reuse_local_chunks(chunk_table, state, partial):
+    """
+    Copia para o arquivo parcial os chunks que faltam e cujo conteúdo (mesmo checksum) este peer
+    já possui em outro arquivo ou versão, evitando baixá-los. Os dados são verificados antes da
+    cópia. Retorna os chunk_ids reaproveitados.
+    """
+    reused = []
+    for index, checksum in enumerate(state.checksums):
+        if checksum is None or state.is_done(index):
+            continue
+        location = chunk_table.find(checksum)
+        if location is None or location[0] == partial.path:
+            continue
+        try:
+            data = read_range(*location)
+        except OSError:
+            continue
+        if hashlib.sha256(data).hexdigest() != checksum:
+            continue
+        if state.layout is not None and len(data) != state.chunk_length(index):
+            continue
+        partial.write_at(state.chunk_offset(index), data)
+        state.mark_done(index, len(data))
+        reused.append(index)
+    return reused
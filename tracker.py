@@ -1,118 +1,621 @@
 from xmlrpc.server import SimpleXMLRPCServer
-import xmlrpc.client
+from concurrent.futures import ThreadPoolExecutor
 import threading
+import argparse
+import heapq
 import time
 import os
 import hashlib
+from connpool import KeepAliveRequestHandler, PooledServerProxy
+from tracker_store import TrackerStore, SNAPSHOT_INTERVAL
+from collections import deque
 
 # Dicionários para armazenar clientes e seus heartbeats
 clients = {}
 heartbeat_status = {}
 heart = 15  # Tempo limite para heartbeat (em segundos)
 
-# Dicionário para armazenar chunks dos arquivos
-# Cada registro é uma tupla: (peer_name, chunk_id, chunk_name, checksum)
+# Número padrão de threads que atendem requisições em paralelo
+DEFAULT_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+
+# Fila de prioridade com o prazo de expiração de cada peer: (deadline, peer_name).
+# Cada peer possui no máximo uma entrada válida, registrada em peer_deadline_at.
+peer_deadlines = []
+peer_deadline_at = {}
+
+# Trava que protege todo o estado do tracker; a condição acorda a thread de expiração
+state_lock = threading.Lock()
+reaper_wakeup = threading.Condition(state_lock)
+
+# Índice dos chunks de cada arquivo:
+# file_name -> chave do chunk -> (chunk_id, chunk_name, checksum, offset, tamanho)
+# A chave é o chunk_id (ou o chunk_name, no formato antigo sem identificador).
+# offset e tamanho são None quando o peer não os informa (chunks de tamanho fixo).
 file_chunks = {}
 
+# Índice pelo conteúdo: checksum -> set((file_name, chave do chunk)); chunks iguais em arquivos
+# ou versões diferentes podem ser baixados de qualquer peer que possua um deles
+checksum_chunks = {}
+
+# Peers que possuem cada chunk: file_name -> chave do chunk -> set(peer_name)
+chunk_peers = {}
+
+# Índice reverso: peer_name -> set((file_name, chave do chunk))
+peer_chunks = {}
+
 # Dicionário para armazenar o checksum final de cada arquivo compartilhado
 final_file_checksums = {}
 
+# Checksums de versões já substituídas de cada arquivo: file_name -> set(checksum).
+# Um peer com uma cópia desatualizada que anuncia uma delas não volta a ser a versão do arquivo.
+superseded_checksums = {}
+
+# Tamanho de chunk de cada arquivo, escolhido pelo peer que o compartilhou
+file_chunk_sizes = {}
+
+# Versão de cada arquivo: incrementada a cada peer que passa a ter ou deixa de ter um chunk
+file_versions = {}
+# Últimas mudanças de cada arquivo: file_name -> deque de (versão, adicionado?, peer_name, chave do chunk)
+file_changes = {}
+# Mudanças guardadas por arquivo; quem consulta a partir de uma versão mais antiga recebe a lista completa
+MAX_FILE_CHANGES = 10000
+# Identifica a numeração das versões: muda quando o tracker reinicia sem o estado salvo
+tracker_epoch = os.urandom(8).hex()
+
+# Persistência opcional do estado (TrackerStore); None mantém o estado apenas em memória
+store = None
+# Tempo (em segundos) que os peers restaurados de um estado salvo continuam registrados
+# sem enviar heartbeat, para que não precisem se registrar e anunciar seus chunks novamente
+RESTORE_GRACE = 60
+# Peers restaurados que ainda não enviaram heartbeat
+restored_peers = set()
+
+def log_operation(op, *args):
+    """ Registra uma alteração do estado no log persistente, se ativo (requer state_lock) """
+    if store is not None:
+        store.append(op, *args)
+
 def register(name, address):
     """ Registra um novo cliente no tracker """
-    if name in clients:
-        return f"Error: O nome '{name}' já está em uso. Escolha outro."
-    clients[name] = address
-    heartbeat_status[name] = time.time()
+    with state_lock:
+        if name in clients:
+            if name not in restored_peers:
+                return f"Error: O nome '{name}' já está em uso. Escolha outro."
+            # O peer reiniciou após a restauração do tracker: a nova sessão substitui a restaurada
+            remove_peer(name)
+        clients[name] = address
+        heartbeat_status[name] = time.time()
+        schedule_expiry(name, heartbeat_status[name] + heart)
+        log_operation("register", name, address)
     return f"{name} registrado com sucesso."
 
 def list_clients():
-    """ Retorna a lista de clientes conectados ao tracker e remove os peers inativos.
-        Ao remover um peer, também remove seus chunks do dicionário file_chunks.
-    """
-    for name in list(heartbeat_status.keys()):
-        if time.time() - heartbeat_status[name] > heart:
-            print(f"O peer {name} foi removido por inatividade.")
-            # Remove o peer dos dicionários de clientes e heartbeats
-            del clients[name]
-            del heartbeat_status[name]
-            # Remove os chunks registrados pertencentes a este peer
-            for file in list(file_chunks.keys()):
-                # Filtra removendo os chunks cujo primeiro elemento (peer_name) é o peer inativo
-                file_chunks[file] = [entry for entry in file_chunks[file] if entry[0] != name]
-                # Se não houver mais chunks para este arquivo, remove a chave
-                if not file_chunks[file]:
-                    del file_chunks[file]
-    return clients
+    """ Retorna a lista de clientes conectados ao tracker.
+        A remoção dos peers inativos é feita pela thread reap_inactive_peers.
+    """
+    with state_lock:
+        return dict(clients)
 
 def get_peer_address(name):
     """ Retorna o endereço de um cliente pelo nome """
-    return clients.get(name, "Peer não encontrado.")
+    with state_lock:
+        return clients.get(name, "Peer não encontrado.")
 
 def heartbeat(name):
     """ Atualiza o status do heartbeat de um cliente """
-    if name in heartbeat_status:
-        heartbeat_status[name] = time.time()
-        return True
+    with state_lock:
+        if name in heartbeat_status:
+            heartbeat_status[name] = time.time()
+            restored_peers.discard(name)
+            return True
     return False
 
-def register_chunks(peer_name, file_name, chunks, file_checksum=None):
+def schedule_expiry(name, deadline):
+    """ Agenda o prazo de expiração de um peer na fila de prioridade (requer state_lock) """
+    peer_deadline_at[name] = deadline
+    heapq.heappush(peer_deadlines, (deadline, name))
+    reaper_wakeup.notify()
+
+def remove_peer(name):
+    """ Remove um peer, seus heartbeats e seus chunks (requer state_lock) """
+    clients.pop(name, None)
+    heartbeat_status.pop(name, None)
+    peer_deadline_at.pop(name, None)
+    restored_peers.discard(name)
+    remove_peer_chunks(name)
+    log_operation("remove_peer", name)
+
+def reap_inactive_peers():
+    """
+    Thread de expiração: dorme até o prazo mais próximo da fila de prioridade e remove
+    os peers que não enviaram heartbeat dentro do limite. Um peer que enviou heartbeat
+    desde o agendamento é apenas reagendado para o novo prazo, em O(log n).
+    """
+    with reaper_wakeup:
+        while True:
+            if not peer_deadlines:
+                reaper_wakeup.wait()
+                continue
+            deadline, name = peer_deadlines[0]
+            now = time.time()
+            if deadline > now:
+                reaper_wakeup.wait(deadline - now)
+                continue
+            heapq.heappop(peer_deadlines)
+            if peer_deadline_at.get(name) != deadline:
+                # Entrada obsoleta (peer removido ou registrado novamente)
+                continue
+            last_seen = heartbeat_status[name]
+            if now - last_seen > heart:
+                print(f"O peer {name} foi removido por inatividade.")
+                remove_peer(name)
+            else:
+                schedule_expiry(name, last_seen + heart)
+
+def remove_peer_chunks(peer_name):
+    """
+    Remove todos os chunks registrados por um peer usando o índice reverso,
+    sem percorrer os chunks dos demais peers (requer state_lock).
+    """
+    for file_name, key in peer_chunks.pop(peer_name, set()):
+        holders = chunk_peers.get(file_name, {}).get(key)
+        if holders is None:
+            continue
+        holders.discard(peer_name)
+        record_change(file_name, False, peer_name, key)
+        if not holders:
+            # Nenhum peer possui mais este chunk
+            del chunk_peers[file_name][key]
+            forget_content(file_name, key, file_chunks[file_name].pop(key)[2])
+            # Se não houver mais chunks para este arquivo, remove a chave
+            if not file_chunks[file_name]:
+                del file_chunks[file_name]
+                del chunk_peers[file_name]
+
+def forget_content(file_name, key, checksum):
+    """ Remove um chunk do índice pelo conteúdo (requer state_lock) """
+    entries = checksum_chunks.get(checksum)
+    if entries is None:
+        return
+    entries.discard((file_name, key))
+    if not entries:
+        del checksum_chunks[checksum]
+
+def record_change(file_name, added, peer_name, key):
+    """ Registra que um peer passou a ter (ou deixou de ter) um chunk do arquivo (requer state_lock) """
+    version = file_versions.get(file_name, 0) + 1
+    file_versions[file_name] = version
+    changes = file_changes.get(file_name)
+    if changes is None:
+        changes = file_changes[file_name] = deque(maxlen=MAX_FILE_CHANGES)
+    changes.append((version, added, peer_name, key))
+
+def reset_changes(file_name, version=None):
+    """
+    Descarta o histórico de mudanças de um arquivo, opcionalmente fixando sua versão; consultas
+    de versões anteriores passam a receber a lista completa (requer state_lock)
+    """
+    file_versions[file_name] = version if version is not None else file_versions.get(file_name, 0) + 1
+    file_changes.pop(file_name, None)
+
+def drop_file_chunks(file_name):
+    """ Esquece todos os chunks registrados de um arquivo, por exemplo de uma versão anterior (requer state_lock) """
+    reset_changes(file_name)
+    for key, entry in file_chunks.pop(file_name, {}).items():
+        forget_content(file_name, key, entry[2])
+    for key, holders in chunk_peers.pop(file_name, {}).items():
+        for holder in holders:
+            peer_chunks.get(holder, set()).discard((file_name, key))
+
+def register_chunks(peer_name, file_name, chunks, file_checksum=None, chunk_size=None, replaces=None):
     """
     Registra os chunks de um arquivo disponíveis em um peer.
-    Cada chunk deve ser uma tupla (chunk_id, chunk_name, checksum).
-    Se for informado o checksum final do arquivo, ele é armazenado.
+    Cada chunk deve ser uma tupla (chunk_id, chunk_name, checksum) ou, para chunks de tamanho
+    variável, (chunk_id, chunk_name, checksum, offset, tamanho).
+    Se for informado o checksum final do arquivo, ele é armazenado. Um checksum diferente do
+    registrado só é aceito como nova versão do arquivo (e os chunks da versão anterior são
+    descartados) se a versão registrada estiver em `replaces`, os checksums que o arquivo do peer
+    já teve, ou se ela não tiver mais peers. Caso contrário, o anúncio vem de uma cópia
+    desatualizada: ele é ignorado e a função retorna False.
+    `chunk_size` é o tamanho de chunk escolhido para o arquivo pelo peer que o compartilhou.
+    O registro é idempotente: registrar novamente o mesmo chunk pelo mesmo peer não gera duplicatas.
+    Um peer que não está registrado (por exemplo, removido por falta de heartbeat) recebe uma
+    resposta de erro e precisa se registrar novamente antes de anunciar seus chunks.
+    """
+    announcement = parse_announcement(file_name, chunks, file_checksum, chunk_size, replaces)
+    with state_lock:
+        if peer_name not in clients:
+            return unknown_peer_error(peer_name)
+        accepted = add_chunks(peer_name, *announcement)
+    if not accepted:
+        print(f"Anúncio do arquivo '{file_name}' por {peer_name} ignorado: o tracker mantém outra versão do arquivo.")
+        return False
+    print(f"Chunks do arquivo '{file_name}' registrados no tracker (por {peer_name}).")
+    return True
+
+def register_chunks_batch(peer_name, announcements):
+    """
+    Registra de uma só vez vários anúncios de chunks de um peer.
+    Cada anúncio é uma lista [file_name, chunks, file_checksum], [file_name, chunks, file_checksum,
+    chunk_size] ou [file_name, chunks, file_checksum, chunk_size, replaces], no mesmo formato de
+    register_chunks; anúncios de cópias desatualizadas são ignorados. Se algum anúncio for
+    inválido, ou se o peer não estiver registrado, nenhum deles é registrado.
+    """
+    total = 0
+    parsed = [parse_announcement(*announcement) for announcement in announcements]
+    with state_lock:
+        if peer_name not in clients:
+            return unknown_peer_error(peer_name)
+        for announcement in parsed:
+            if add_chunks(peer_name, *announcement):
+                total += len(announcement[1])
+    print(f"{total} chunks de {len(announcements)} arquivo(s) registrados no tracker (por {peer_name}).")
+    return True
+
+def unknown_peer_error(peer_name):
+    """ Resposta aos anúncios de um peer que o tracker não conhece (ou já removeu) """
+    print(f"Anúncio de chunks recusado: o peer {peer_name} não está registrado.")
+    return f"Error: O peer '{peer_name}' não está registrado no tracker. Registre-se novamente."
+
+def parse_announcement(file_name, chunks, file_checksum=None, chunk_size=None, replaces=None):
+    """
+    Valida um anúncio de chunks e converte cada chunk para uma tupla (chunk_id, chunk_name,
+    checksum, offset, tamanho). Lança ValueError se algum campo estiver em um formato inválido,
+    antes que o anúncio altere o estado ou seja gravado no log.
+    Retorna (file_name, chunks, file_checksum, chunk_size, replaces).
     """
-    if file_name not in file_chunks:
-        file_chunks[file_name] = []
+    if not isinstance(file_name, str) or not isinstance(chunks, (list, tuple)):
+        raise ValueError(f"Anúncio inválido do arquivo {file_name!r}.")
+    if not all(value is None or isinstance(value, str) for value in [file_checksum] + list(replaces or ())):
+        raise ValueError(f"Checksum inválido no anúncio do arquivo '{file_name}'.")
+    if chunk_size is not None and (not isinstance(chunk_size, int) or chunk_size <= 0):
+        raise ValueError(f"Tamanho de chunk inválido no anúncio do arquivo '{file_name}': {chunk_size!r}")
+    parsed = []
     for chunk in chunks:
-        if len(chunk) == 3:
+        if not isinstance(chunk, (list, tuple)) or len(chunk) not in (2, 3, 5):
+            raise ValueError(f"Chunk inválido no anúncio do arquivo '{file_name}': {chunk!r}")
+        offset = length = None
+        if len(chunk) == 5:
+            chunk_id, chunk_name, checksum, offset, length = chunk
+        elif len(chunk) == 3:
             chunk_id, chunk_name, checksum = chunk
         else:
             # Fallback para formato antigo
             chunk_id = None
             chunk_name, checksum = chunk
-        file_chunks[file_name].append((peer_name, chunk_id, chunk_name, checksum))
+        if (not isinstance(chunk_name, str) or not (checksum is None or isinstance(checksum, str))
+                or not all(value is None or isinstance(value, int) for value in (chunk_id, offset, length))):
+            raise ValueError(f"Chunk inválido no anúncio do arquivo '{file_name}': {chunk!r}")
+        parsed.append((chunk_id, chunk_name, checksum, offset, length))
+    return file_name, parsed, file_checksum, chunk_size, list(replaces or ())
+
+def add_chunks(peer_name, file_name, chunks, file_checksum=None, chunk_size=None, replaces=None):
+    """
+    Insere os chunks de um peer nos índices do tracker (requer state_lock).
+    Os chunks já devem estar no formato de parse_announcement.
+    Retorna False, sem alterar o estado, se o anúncio for de uma cópia desatualizada do arquivo.
+    """
+    predecessors = set(replaces or ()) - {file_checksum}
+    previous = final_file_checksums.get(file_name)
+    if file_checksum is not None and previous is not None and previous != file_checksum:
+        if previous not in predecessors and (file_checksum in superseded_checksums.get(file_name, ())
+                                             or file_name in file_chunks):
+            return False
+        predecessors.add(previous)
+        drop_file_chunks(file_name)
+    log_operation("add_chunks", peer_name, file_name, chunks, file_checksum, chunk_size, replaces)
+    index = file_chunks.setdefault(file_name, {})
+    holders_by_chunk = chunk_peers.setdefault(file_name, {})
+    owned = peer_chunks.setdefault(peer_name, set())
+    for chunk_id, chunk_name, checksum, offset, length in chunks:
+        key = chunk_id if chunk_id is not None else chunk_name
+        current = index.get(key)
+        if current is not None and current[2] == checksum and offset is None:
+            # Registro sem posição de um chunk já conhecido: mantém o offset e o tamanho anteriores
+            offset, length = current[3:]
+        if current is not None and current[2] != checksum:
+            # O conteúdo do chunk mudou: os peers antigos não possuem mais a versão válida
+            for holder in holders_by_chunk.get(key, set()):
+                peer_chunks.get(holder, set()).discard((file_name, key))
+                record_change(file_name, False, holder, key)
+            holders_by_chunk[key] = set()
+            forget_content(file_name, key, current[2])
+        index[key] = (chunk_id, chunk_name, checksum, offset, length)
+        if checksum is not None:
+            checksum_chunks.setdefault(checksum, set()).add((file_name, key))
+        holders = holders_by_chunk.setdefault(key, set())
+        if peer_name not in holders:
+            holders.add(peer_name)
+            record_change(file_name, True, peer_name, key)
+        owned.add((file_name, key))
     if file_checksum is not None:
         final_file_checksums[file_name] = file_checksum
-    print(f"Chunks do arquivo '{file_name}' registrados no tracker (por {peer_name}).")
+    if chunk_size is not None:
+        file_chunk_sizes[file_name] = chunk_size
+    if file_checksum is not None and predecessors:
+        superseded = superseded_checksums.setdefault(file_name, set())
+        superseded.update(predecessors)
+        # Um arquivo que voltou a um conteúdo anterior deixa de ter essa versão como substituída
+        superseded.discard(file_checksum)
     return True
 
 def get_file_chunks(file_name):
-    """ Retorna a lista de chunks de um arquivo e seus respectivos peers """
-    return file_chunks.get(file_name, [])
+    """
+    Retorna a lista de chunks de um arquivo e seus respectivos peers.
+    Cada registro é uma tupla: (peer_name, chunk_id, chunk_name, checksum), sem duplicatas.
+    """
+    entries = []
+    with state_lock:
+        holders_by_chunk = chunk_peers.get(file_name, {})
+        for key, entry in file_chunks.get(file_name, {}).items():
+            chunk_id, chunk_name, checksum = entry[:3]
+            for peer_name in sorted(holders_by_chunk.get(key, ())):
+                entries.append((peer_name, chunk_id, chunk_name, checksum))
+    return entries
+
+def get_download_plan(file_name):
+    """
+    Retorna, em uma única resposta, tudo o que um peer precisa para baixar um arquivo:
+      - checksum: checksum final do arquivo (ou "Checksum não encontrado.");
+      - chunk_size: tamanho de chunk do arquivo (None se o peer não o informou);
+      - chunks: lista ordenada de dicionários {chunk_id, chunk_name, checksum, offset, length, peers};
+        offset e length são None para chunks de tamanho fixo, e peers inclui quem possui o
+        mesmo conteúdo (mesmo checksum) em outros arquivos ou versões;
+      - addresses: endereço de cada peer que aparece em algum chunk;
+      - epoch e version: versão atual dos peers do arquivo, para consultas em get_chunk_changes.
+    """
+    with state_lock:
+        checksum = final_file_checksums.get(file_name, "Checksum não encontrado.")
+        chunk_size = file_chunk_sizes.get(file_name)
+        version = file_versions.get(file_name, 0)
+        holders_by_chunk = chunk_peers.get(file_name, {})
+        chunks = []
+        addresses = {}
+        for key, (chunk_id, chunk_name, chunk_checksum, offset, length) in file_chunks.get(file_name, {}).items():
+            holders = set(holders_by_chunk.get(key, ()))
+            for other_file, other_key in checksum_chunks.get(chunk_checksum, ()):
+                holders.update(chunk_peers.get(other_file, {}).get(other_key, ()))
+            peers = sorted(peer for peer in holders if peer in clients)
+            for peer in peers:
+                addresses[peer] = clients[peer]
+            chunks.append({
+                "chunk_id": chunk_id,
+                "chunk_name": chunk_name,
+                "checksum": chunk_checksum,
+                "offset": offset,
+                "length": length,
+                "peers": peers,
+            })
+    chunks.sort(key=lambda c: (c["chunk_id"] is None, c["chunk_id"] or 0))
+    return {"file_name": file_name, "checksum": checksum, "chunk_size": chunk_size, "chunks": chunks,
+            "addresses": addresses, "epoch": tracker_epoch, "version": version}
+
+def get_chunk_changes(file_name, since_version, epoch=None):
+    """
+    Retorna apenas as mudanças nos peers de um arquivo desde `since_version`:
+      - epoch e version: versão atual, a ser usada na próxima consulta;
+      - full: True se as mudanças pedidas não estão mais disponíveis (versão antiga demais ou
+        de outra numeração); nesse caso, o cliente deve buscar o plano completo (get_download_plan);
+      - added e removed: pares [peer_name, chunk_id] que passaram a ter ou deixaram de ter o chunk;
+      - addresses: endereço dos peers em added.
+    Os peers que possuem o mesmo conteúdo em outros arquivos não entram nas mudanças.
+    """
+    with state_lock:
+        version = file_versions.get(file_name, 0)
+        changes = file_changes.get(file_name, ())
+        oldest = changes[0][0] - 1 if changes else version
+        result = {"epoch": tracker_epoch, "version": version, "full": False,
+                  "added": [], "removed": [], "addresses": {}}
+        if epoch != tracker_epoch or since_version > version or since_version < oldest:
+            result["full"] = True
+            return result
+        # Apenas o resultado final de cada par (peer, chunk) no intervalo
+        latest = {}
+        for change_version, added, peer_name, key in changes:
+            if change_version > since_version:
+                latest[(peer_name, key)] = added
+        for (peer_name, key), added in latest.items():
+            if added:
+                result["added"].append([peer_name, key])
+                if peer_name in clients:
+                    result["addresses"][peer_name] = clients[peer_name]
+            else:
+                result["removed"].append([peer_name, key])
+    return result
 
 def get_file_checksum(file_name):
     """ Retorna o checksum final do arquivo, se registrado """
-    return final_file_checksums.get(file_name, "Checksum não encontrado.")
+    with state_lock:
+        return final_file_checksums.get(file_name, "Checksum não encontrado.")
+
+def snapshot_state():
+    """ Cópia serializável do estado persistente do tracker (requer state_lock) """
+    files = {}
+    for file_name in set(file_chunks) | set(final_file_checksums):
+        holders_by_chunk = chunk_peers.get(file_name, {})
+        files[file_name] = {
+            "checksum": final_file_checksums.get(file_name),
+            "chunk_size": file_chunk_sizes.get(file_name),
+            "chunks": [[list(entry), sorted(holders_by_chunk.get(key, ()))]
+                       for key, entry in file_chunks.get(file_name, {}).items()],
+            "version": file_versions.get(file_name, 0),
+            "superseded": sorted(superseded_checksums.get(file_name, ())),
+        }
+    return {"clients": dict(clients), "files": files, "epoch": tracker_epoch}
+
+def restore_state(state, operations):
+    """
+    Reconstrói o estado a partir de um snapshot e das operações registradas depois dele
+    (requer state_lock). Os peers restaurados têm RESTORE_GRACE segundos para enviar um
+    heartbeat antes de serem removidos.
+    """
+    global tracker_epoch
+    if state is not None:
+        # A numeração das versões continua a mesma de antes da reinicialização
+        tracker_epoch = state.get("epoch", tracker_epoch)
+        clients.update(state["clients"])
+        for file_name, info in state["files"].items():
+            by_peer = {}
+            for entry, holders in info["chunks"]:
+                for peer_name in holders:
+                    by_peer.setdefault(peer_name, []).append(entry)
+            for peer_name, chunks in by_peer.items():
+                add_chunks(peer_name, *parse_announcement(file_name, chunks))
+            if info["checksum"] is not None:
+                final_file_checksums[file_name] = info["checksum"]
+            if info["chunk_size"] is not None:
+                file_chunk_sizes[file_name] = info["chunk_size"]
+            if info.get("superseded"):
+                superseded_checksums[file_name] = set(info["superseded"])
+            reset_changes(file_name, info.get("version", 0))
+    for op, args in operations:
+        try:
+            replay_operation(op, args)
+        except (ValueError, TypeError) as e:
+            # Uma operação inválida no log não impede a restauração das demais
+            print(f"Operação '{op}' do log ignorada na restauração: {e}")
+    now = time.time()
+    for name in clients:
+        heartbeat_status[name] = now
+        restored_peers.add(name)
+        schedule_expiry(name, now + RESTORE_GRACE)
+
+def replay_operation(op, args):
+    """ Aplica uma operação do log persistente (requer state_lock) """
+    if op == "register":
+        name, address = args
+        clients[name] = address
+    elif op == "remove_peer":
+        remove_peer(*args)
+    elif op == "add_chunks":
+        peer_name, *announcement = args
+        add_chunks(peer_name, *parse_announcement(*announcement))
+    else:
+        raise ValueError("operação desconhecida")
+
+def take_snapshot():
+    """ Grava um snapshot do estado e descarta o log já incluído nele """
+    with state_lock:
+        if not store.ops_since_snapshot:
+            return
+        seq = store.begin_snapshot()
+        state = snapshot_state()
+    # A gravação ocorre fora da trava: as novas operações vão para o novo segmento do log
+    store.finish_snapshot(seq, state)
+
+def snapshot_periodically():
+    while True:
+        store.snapshot_requested.wait(SNAPSHOT_INTERVAL)
+        store.snapshot_requested.clear()
+        take_snapshot()
+
+def enable_persistence(directory, fsync=False):
+    """ Restaura o estado salvo em `directory` e passa a registrar as alterações nele """
+    global store
+    new_store = TrackerStore(directory, fsync)
+    state, operations = new_store.load()
+    with state_lock:
+        restore_state(state, operations)
+        store = new_store
+        restored = len(clients)
+        files = len(final_file_checksums)
+    print(f"Estado restaurado de '{directory}': {restored} peer(s) e {files} arquivo(s), "
+          f"{len(operations)} operação(ões) do log.")
+    # O estado reconstruído vira o novo snapshot, e o log recomeça vazio
+    take_snapshot()
+    threading.Thread(target=snapshot_periodically, daemon=True).start()
 
 def send_message(peer_name, message):
     """ Permite que um peer envie mensagens para outro """
-    if peer_name in clients:
-        peer_address = clients[peer_name]
+    with state_lock:
+        peer_address = clients.get(peer_name)
+    if peer_address is not None:
         try:
-            with xmlrpc.client.ServerProxy(peer_address) as peer_proxy:
-                return peer_proxy.receive_message(message, peer_name)
+            return PooledServerProxy(peer_address).receive_message(message, peer_name)
         except Exception as e:
             return f"Erro ao enviar mensagem para {peer_name}: {e}"
     return f"Erro: Peer '{peer_name}' não encontrado."
 
-def start_server():
-    """ Inicia o servidor XML-RPC """
-    server = SimpleXMLRPCServer(('localhost', 9000), allow_none=True)
+class PooledXMLRPCServer(SimpleXMLRPCServer):
+    """
+    Servidor XML-RPC que atende cada conexão em um pool de threads de tamanho fixo,
+    para que um cliente lento não bloqueie os heartbeats e consultas dos demais peers.
+    As conexões são persistentes (keep-alive) enquanto houver threads livres; quando há
+    conexões esperando, as ociosas são encerradas para liberar suas threads.
+    """
+    request_queue_size = 128
+
+    def __init__(self, addr, workers=DEFAULT_WORKERS, **kwargs):
+        kwargs.setdefault("requestHandler", KeepAliveRequestHandler)
+        super().__init__(addr, **kwargs)
+        self.workers = workers
+        self.connections = 0
+        self.connections_lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="tracker")
+
+    def saturated(self):
+        """ Indica se há conexões aguardando uma thread livre """
+        return self.connections > self.workers
+
+    def process_request(self, request, client_address):
+        with self.connections_lock:
+            self.connections += 1
+        self.executor.submit(self.process_request_thread, request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            with self.connections_lock:
+                self.connections -= 1
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=True)
+
+def start_server(workers=DEFAULT_WORKERS, port=9000):
+    """
+    Inicia o servidor XML-RPC com um pool de `workers` threads.
+    Vários trackers (em portas diferentes) podem formar um tracker particionado: os peers dividem
+    os arquivos entre eles por hashing consistente e se registram em todos (ShardedTracker).
+    """
+    server = PooledXMLRPCServer(('localhost', port), workers=workers, allow_none=True)
     server.register_function(register, 'register')
     server.register_function(list_clients, 'list_clients')
     server.register_function(get_peer_address, 'get_peer_address')
     server.register_function(heartbeat, 'heartbeat')
     server.register_function(register_chunks, 'register_chunks')
+    server.register_function(register_chunks_batch, 'register_chunks_batch')
     server.register_function(get_file_chunks, 'get_file_chunks')
     server.register_function(get_file_checksum, 'get_file_checksum')
+    server.register_function(get_download_plan, 'get_download_plan')
+    server.register_function(get_chunk_changes, 'get_chunk_changes')
     server.register_function(send_message, 'send_message')
-    print("Servidor rodando na porta 9000...")
+    print(f"Servidor rodando na porta {port} com {workers} threads...")
     server.serve_forever()
 
 if __name__ == "__main__":
-    heartbeat_thread = threading.Thread(target=list_clients, daemon=True)
-    heartbeat_thread.start()
+    parser = argparse.ArgumentParser(description="Tracker da rede P2P")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help="Número de threads que atendem requisições em paralelo")
+    parser.add_argument("--port", type=int, default=9000,
+                        help="Porta do tracker (cada shard de um tracker particionado usa uma porta)")
+    parser.add_argument("--state-dir",
+                        help="Diretório onde o estado é salvo (snapshot + log) e restaurado ao reiniciar")
+    parser.add_argument("--grace", type=float, default=RESTORE_GRACE,
+                        help="Segundos que os peers restaurados têm para enviar um heartbeat")
+    parser.add_argument("--fsync", action="store_true",
+                        help="Sincroniza cada operação do log com o disco")
+    args = parser.parse_args()
+    RESTORE_GRACE = args.grace
+    if args.state_dir:
+        enable_persistence(args.state_dir, args.fsync)
+    reaper_thread = threading.Thread(target=reap_inactive_peers, daemon=True)
+    reaper_thread.start()
     try:
-        start_server()
+        start_server(args.workers, args.port)
     except KeyboardInterrupt:
         print("Servidor interrompido.")
@@ -0,0 +1,331 @@
+import threading
+import hashlib
+import bisect
+import time
+from connpool import PooledServerProxy
+
+# Pontos de cada tracker no anel de hashing consistente (mais pontos = divisão mais uniforme)
+VIRTUAL_NODES = 64
+
+def ring_hash(key):
+    return int.from_bytes(hashlib.sha1(key.encode("utf-8")).digest()[:8], "big")
+
+def is_error(response):
+    """ Indica se a resposta do tracker é uma mensagem de erro ("Error: ...") """
+    return isinstance(response, str) and response.startswith("Error:")
+
+class HashRing:
+    """
+    Anel de hashing consistente: cada nó (endereço de tracker) ocupa `virtual_nodes` pontos do
+    anel, e cada chave pertence ao primeiro ponto a partir do seu hash. Incluir ou remover um
+    tracker move apenas as chaves da fatia dele. Todos os peers devem usar a mesma lista de
+    endereços, escritos da mesma forma.
+    """
+    def __init__(self, nodes, virtual_nodes=VIRTUAL_NODES):
+        self.points = sorted((ring_hash(f"{node}#{i}"), node) for node in nodes for i in range(virtual_nodes))
+        self.hashes = [point for point, _ in self.points]
+
+    def node_for(self, key):
+        index = bisect.bisect(self.hashes, ring_hash(key)) % len(self.points)
+        return self.points[index][1]
+
+class ShardedTracker:
+    """
+    Cliente de um tracker particionado em vários processos (shards), seguro entre threads:
+      - os arquivos são divididos entre os shards por hashing consistente do file_name, e as
+        operações de um arquivo (register_chunks, get_file_chunks, get_file_checksum,
+        get_download_plan, get_chunk_changes) vão para o shard dono dele; register_chunks_batch é dividido por shard;
+      - o registro do peer e os heartbeats são replicados em todos os shards, para que cada um
+        conheça o endereço dos peers dos seus arquivos. Um shard que não conhece mais o peer
+        (por exemplo, reiniciado, ou que o removeu por falta de heartbeat) recebe o registro
+        novamente no próximo heartbeat ou ao recusar um anúncio de chunks. Um shard fora do ar
+        durante o registro também o recebe no primeiro heartbeat a que responder;
+      - as demais consultas (list_clients, get_peer_address, ...) vão ao primeiro shard que responder.
+    `addresses` é um endereço ou uma lista deles; com um único endereço, equivale a um
+    PooledServerProxy para o tracker.
+    """
+    def __init__(self, addresses):
+        if isinstance(addresses, str):
+            addresses = [addresses]
+        self.addresses = list(addresses)
+        self.shards = {address: PooledServerProxy(address) for address in self.addresses}
+        self.ring = HashRing(self.addresses)
+        # (nome, endereço) do registro deste peer, repetido nos shards que o esquecerem
+        self.registration = None
+
+    def shard_for(self, file_name):
+        return self.shards[self.ring.node_for(file_name)]
+
+    def register_chunks(self, peer_name, file_name, *args):
+        shard = self.shard_for(file_name)
+        return self._announce(shard, peer_name, lambda: shard.register_chunks(peer_name, file_name, *args))
+
+    def register_chunks_batch(self, peer_name, announcements):
+        """ Envia cada parte do lote ao seu shard; retorna True ou a primeira resposta de erro """
+        batches = {}
+        for announcement in announcements:
+            batches.setdefault(self.ring.node_for(announcement[0]), []).append(announcement)
+        errors = []
+        for address, batch in batches.items():
+            shard = self.shards[address]
+            response = self._announce(shard, peer_name, lambda: shard.register_chunks_batch(peer_name, batch))
+            if is_error(response):
+                errors.append(response)
+        return errors[0] if errors else True
+
+    def _announce(self, shard, peer_name, send):
+        """ Envia um anúncio de chunks; se o shard não conhecer o peer, registra-o de novo e repete """
+        response = send()
+        if is_error(response) and self._reregister(shard, peer_name):
+            response = send()
+        return response
+
+    def _reregister(self, shard, name):
+        """ Repete o registro deste peer em um shard que o esqueceu; retorna True se ele foi aceito """
+        if self.registration is None or self.registration[0] != name:
+            return False
+        return not is_error(shard.register(*self.registration))
+
+    def get_file_chunks(self, file_name):
+        return self.shard_for(file_name).get_file_chunks(file_name)
+
+    def get_file_checksum(self, file_name):
+        return self.shard_for(file_name).get_file_checksum(file_name)
+
+    def get_download_plan(self, file_name):
+        return self.shard_for(file_name).get_download_plan(file_name)
+
+    def get_chunk_changes(self, file_name, *args):
+        return self.shard_for(file_name).get_chunk_changes(file_name, *args)
+
+    def register(self, name, address):
+        """
+        Registra o peer em cada shard e retorna a primeira resposta de erro, se houver (nome em uso).
+        Os shards que aceitaram um registro recusado por outro o descartam quando os heartbeats não
+        chegarem. Shards indisponíveis não impedem o registro: são informados na resposta e recebem
+        o registro no primeiro heartbeat a que responderem. Só falha se nenhum shard responder.
+        """
+        responses = []
+        unavailable = []
+        error = None
+        for shard_address, shard in self.shards.items():
+            try:
+                responses.append(shard.register(name, address))
+            except OSError as e:
+                unavailable.append(shard_address)
+                error = e
+        if not responses:
+            raise error
+        errors = [response for response in responses if is_error(response)]
+        if errors:
+            return errors[0]
+        self.registration = (name, address)
+        if unavailable:
+            return f"{responses[0]} Shards do tracker indisponíveis: {', '.join(unavailable)}."
+        return responses[0]
+
+    def heartbeat(self, name):
+        """ Envia o heartbeat a todos os shards; só falha se nenhum deles responder """
+        error = None
+        alive = False
+        for shard in self.shards.values():
+            try:
+                if not shard.heartbeat(name):
+                    self._reregister(shard, name)
+                alive = True
+            except Exception as e:
+                error = e
+        if not alive:
+            raise error
+        return True
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return lambda *args: self._call_any(name, args)
+
+    def _call_any(self, name, args):
+        error = None
+        for shard in self.shards.values():
+            try:
+                return getattr(shard, name)(*args)
+            except OSError as e:
+                # Shard indisponível: tenta o próximo
+                error = e
+        raise error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+# Intervalo (em segundos) entre as consultas de novas fontes durante um download
+SOURCE_REFRESH_INTERVAL = 5
+
+class SourceRefresher:
+    """
+    Atualiza as fontes de um download em andamento: a cada `interval` segundos, pede ao tracker
+    só as mudanças nos peers do arquivo desde a última versão vista (get_chunk_changes) e as
+    aplica ao escalonador e ao dicionário de endereços usado pelo motor de download. Assim,
+    seeders que aparecem durante o download passam a ser usados, e os que saíram deixam de ser.
+    Se as mudanças não estiverem mais disponíveis no tracker, o plano completo é buscado de novo.
+    """
+    def __init__(self, proxy, plan, scheduler, addresses, interval=SOURCE_REFRESH_INTERVAL):
+        self.proxy = proxy
+        self.file_name = plan["file_name"]
+        self.epoch = plan.get("epoch")
+        self.version = plan.get("version", 0)
+        self.scheduler = scheduler
+        self.addresses = addresses
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def refresh(self):
+        """ Consulta o tracker uma vez; retorna o número de fontes novas """
+        changes = self.proxy.get_chunk_changes(self.file_name, self.version, self.epoch)
+        if changes["full"]:
+            plan = self.proxy.get_download_plan(self.file_name)
+            added = [(peer, chunk["chunk_id"]) for chunk in plan["chunks"] for peer in chunk["peers"]]
+            removed = []
+            addresses = plan["addresses"]
+            self.epoch, self.version = plan["epoch"], plan["version"]
+        else:
+            added, removed, addresses = changes["added"], changes["removed"], changes["addresses"]
+            self.epoch, self.version = changes["epoch"], changes["version"]
+        # Os endereços entram antes das fontes, que podem ser usadas imediatamente pelo motor
+        self.addresses.update(addresses)
+        return self.scheduler.update_holders(added, removed)
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                added = self.refresh()
+                if added:
+                    print(f"{added} nova(s) fonte(s) encontrada(s) para '{self.file_name}'.")
+            except Exception as e:
+                print(f"Erro ao atualizar as fontes de '{self.file_name}': {e}")
+
+class ChunkAnnouncer:
+    """
+    Fila de anúncios de chunks para o tracker.
+    Os chunks recém-baixados são acumulados e enviados em lote (register_chunks_batch)
+    quando a fila atinge `max_batch` chunks ou quando `flush_interval` segundos se passam
+    desde o primeiro anúncio pendente, evitando uma chamada ao tracker por chunk.
+    Com o `peer_address` deste peer, um tracker que não o conhece mais recebe o registro
+    novamente antes do anúncio.
+    """
+    def __init__(self, tracker_address, peer_name, max_batch=64, flush_interval=0.5, peer_address=None):
+        # Um endereço ou a lista de endereços de um tracker particionado (ShardedTracker)
+        self.tracker_address = tracker_address
+        self.peer_name = peer_name
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.proxy = ShardedTracker(tracker_address)
+        if peer_address is not None:
+            self.proxy.registration = (peer_name, peer_address)
+        # file_name -> {chunk_id/chunk_name: (chunk_id, chunk_name, checksum)}
+        self.pending = {}
+        self.pending_checksums = {}
+        self.pending_chunk_sizes = {}
+        self.pending_count = 0
+        self.first_pending_at = None
+        # Protege a fila de anúncios pendentes; `wakeup` acorda a thread de envio
+        self.lock = threading.Lock()
+        self.wakeup = threading.Condition(self.lock)
+        # Serializa os envios (o proxy em si é seguro entre threads): um flush() explícito espera
+        # o lote que a thread de envio já retirou da fila, e um lote devolvido após uma falha
+        # não é ultrapassado por um mais novo
+        self.send_lock = threading.Lock()
+        self.stopped = False
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def announce(self, file_name, chunks, file_checksum=None, chunk_size=None):
+        """
+        Enfileira chunks (chunk_id, chunk_name, checksum[, offset, tamanho]) para serem anunciados
+        ao tracker, com o checksum final e o tamanho de chunk do arquivo, se conhecidos.
+        """
+        with self.lock:
+            file_pending = self.pending.setdefault(file_name, {})
+            for chunk in chunks:
+                key = chunk[0] if chunk[0] is not None else chunk[1]
+                if key not in file_pending:
+                    self.pending_count += 1
+                file_pending[key] = tuple(chunk)
+            if file_checksum is not None:
+                self.pending_checksums[file_name] = file_checksum
+            if chunk_size is not None:
+                self.pending_chunk_sizes[file_name] = chunk_size
+            if self.first_pending_at is None:
+                self.first_pending_at = time.time()
+            if self.pending_count >= self.max_batch:
+                self.wakeup.notify()
+
+    def _take_pending(self):
+        """ Retira todos os anúncios pendentes no formato de register_chunks_batch (requer lock) """
+        batch = [
+            [file_name, list(chunks.values()), self.pending_checksums.get(file_name),
+             self.pending_chunk_sizes.get(file_name)]
+            for file_name, chunks in self.pending.items()
+        ]
+        self.pending = {}
+        self.pending_checksums = {}
+        self.pending_chunk_sizes = {}
+        self.pending_count = 0
+        self.first_pending_at = None
+        return batch
+
+    def flush(self):
+        """ Envia imediatamente todos os anúncios pendentes. Retorna True se não houve erro. """
+        with self.send_lock:
+            with self.lock:
+                batch = self._take_pending()
+            if not batch:
+                return True
+            try:
+                response = self.proxy.register_chunks_batch(self.peer_name, batch)
+                if not is_error(response):
+                    return True
+                print(f"Erro ao anunciar chunks ao tracker: {response}")
+            except Exception as e:
+                print(f"Erro ao anunciar chunks ao tracker: {e}")
+            # Devolve o lote para a fila para uma nova tentativa
+            for file_name, chunks, file_checksum, chunk_size in batch:
+                self.announce(file_name, chunks, file_checksum, chunk_size)
+            return False
+
+    def _run(self):
+        while True:
+            with self.lock:
+                while not self.stopped:
+                    if self.pending_count >= self.max_batch:
+                        break
+                    if self.first_pending_at is None:
+                        self.wakeup.wait()
+                        continue
+                    remaining = self.first_pending_at + self.flush_interval - time.time()
+                    if remaining <= 0:
+                        break
+                    self.wakeup.wait(remaining)
+                if self.stopped:
+                    return
+            if not self.flush():
+                time.sleep(self.flush_interval)
+
+    def close(self):
+        """ Encerra a thread de anúncios e envia o que ainda estiver pendente """
+        with self.lock:
+            self.stopped = True
+            self.wakeup.notify()
+        self.thread.join()
+        self.flush()
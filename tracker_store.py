@@ -0,0 +1,140 @@
+import threading
+import json
+import os
+
+# Número de operações no log que dispara um novo snapshot antes do intervalo periódico
+SNAPSHOT_OPS = 10000
+# Intervalo (em segundos) entre snapshots periódicos, se houver operações novas
+SNAPSHOT_INTERVAL = 300
+
+class TrackerStore:
+    """
+    Persistência do estado do tracker em `directory`: um snapshot compactado (tracker.snapshot)
+    e um log append-only das operações posteriores a ele (tracker.log), uma linha JSON
+    [seq, operação, argumentos] por operação.
+    O snapshot guarda o número da última operação incluída, então a reconstrução aplica apenas
+    as operações seguintes do log. Para gerar um snapshot sem bloquear o tracker, o log atual
+    é renomeado para tracker.log.old e um novo segmento é iniciado; o segmento antigo só é
+    apagado depois que o snapshot foi gravado. Com `fsync`, cada operação é sincronizada com o
+    disco (mais lento, mas sobrevive a uma queda de energia, e não só do processo).
+    """
+    def __init__(self, directory, fsync=False):
+        self.directory = directory
+        self.snapshot_path = os.path.join(directory, "tracker.snapshot")
+        self.log_path = os.path.join(directory, "tracker.log")
+        self.old_log_path = f"{self.log_path}.old"
+        self.fsync = fsync
+        self.seq = 0
+        self.ops_since_snapshot = 0
+        self.log = None
+        # Sinaliza que o log cresceu o suficiente para um novo snapshot
+        self.snapshot_requested = threading.Event()
+
+    def _drop_partial_line(self, path):
+        """
+        Remove do fim do log uma linha incompleta (interrupção durante a gravação), para que as
+        próximas operações não sejam gravadas na continuação dela
+        """
+        try:
+            with open(path, "rb+") as f:
+                size = position = f.seek(0, os.SEEK_END)
+                while position > 0:
+                    step = min(4096, position)
+                    f.seek(position - step)
+                    index = f.read(step).rfind(b"\n")
+                    if index >= 0:
+                        position += index + 1 - step
+                        break
+                    position -= step
+                if position < size:
+                    f.truncate(position)
+        except OSError:
+            pass
+
+    def _read_log(self, path, base_seq):
+        operations = []
+        self._drop_partial_line(path)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        seq, op, args = json.loads(line)
+                    except (ValueError, TypeError):
+                        # Linha corrompida: as operações seguintes continuam válidas
+                        print(f"Linha inválida ignorada no log do tracker ({path}).")
+                        continue
+                    if seq > base_seq:
+                        operations.append((seq, op, args))
+        except OSError:
+            pass
+        return operations
+
+    def load(self):
+        """
+        Lê o snapshot e as operações registradas depois dele e abre o log para novas operações.
+        Retorna (estado do snapshot ou None, [(operação, argumentos)]).
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        snapshot = None
+        base_seq = 0
+        try:
+            with open(self.snapshot_path, "r", encoding="utf-8") as f:
+                snapshot = json.load(f)
+            base_seq = snapshot["seq"]
+        except (OSError, ValueError, KeyError, TypeError):
+            snapshot = None
+        operations = self._read_log(self.old_log_path, base_seq) + self._read_log(self.log_path, base_seq)
+        self.seq = max([base_seq] + [seq for seq, _, _ in operations])
+        self.ops_since_snapshot = len(operations)
+        self.log = open(self.log_path, "a", encoding="utf-8")
+        state = snapshot["state"] if snapshot is not None else None
+        return state, [(op, args) for _, op, args in operations]
+
+    def append(self, op, *args):
+        """ Acrescenta uma operação ao log (o chamador garante a ordem, com a trava do estado) """
+        self.seq += 1
+        self.log.write(json.dumps([self.seq, op, args]) + "\n")
+        self.log.flush()
+        if self.fsync:
+            os.fsync(self.log.fileno())
+        self.ops_since_snapshot += 1
+        if self.ops_since_snapshot >= SNAPSHOT_OPS:
+            self.snapshot_requested.set()
+
+    def begin_snapshot(self):
+        """
+        Fecha o segmento atual do log e inicia um novo; retorna o número da última operação que
+        o snapshot deve incluir. Deve ser chamado com a trava do estado, junto com a cópia do estado.
+        """
+        self.log.close()
+        if os.path.exists(self.old_log_path):
+            # Um snapshot anterior falhou: o segmento antigo é mantido e recebe o atual
+            with open(self.log_path, "r", encoding="utf-8") as current, \
+                    open(self.old_log_path, "a", encoding="utf-8") as old:
+                old.write(current.read())
+            os.remove(self.log_path)
+        else:
+            os.replace(self.log_path, self.old_log_path)
+        self.log = open(self.log_path, "a", encoding="utf-8")
+        self.ops_since_snapshot = 0
+        return self.seq
+
+    def finish_snapshot(self, seq, state):
+        """ Grava o snapshot de forma atômica e descarta o segmento antigo do log (sem a trava do estado) """
+        temp_path = f"{self.snapshot_path}.tmp"
+        try:
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump({"seq": seq, "state": state}, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.snapshot_path)
+            os.remove(self.old_log_path)
+        except OSError as e:
+            print(f"Erro ao gravar o snapshot do tracker: {e}")
+            return False
+        return True
+
+    def close(self):
+        if self.log is not None:
+            self.log.close()
+            self.log = None
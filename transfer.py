@@ -0,0 +1,206 @@
+import socketserver
+import xmlrpc.client
+import threading
+import socket
+import time
+import os
+from urllib.parse import urlparse
+from connpool import PooledServerProxy
+from upload import SEND_BLOCK
+from compression import choose_encoding, compress, range_encoding
+
+# Tamanho dos blocos lidos do socket ao receber um chunk
+RECV_BUFFER = 64 * 1024
+# Tempo limite (em segundos) das conexões do canal de dados
+DATA_TIMEOUT = 30
+
+class TransferCancelled(Exception):
+    """ A transferência de um chunk foi cancelada porque outra requisição já o concluiu """
+
+# -------------------------
+# PROTOCOLO DO CANAL DE DADOS
+# -------------------------
+# Requisição: "GET <chunk_name>\n"
+# Resposta:   "OK <tamanho>\n" seguido dos bytes do chunk, ou "ERR <mensagem>\n".
+# A mesma conexão pode ser usada para várias requisições em sequência.
+# Opcionalmente, o cliente se identifica com "PEER <nome>\n" (sem resposta); sem isso,
+# o peer é identificado pelo endereço IP, usado na fila justa e nos limites de upload.
+# Com "ACCEPT <compressão>[,<compressão>...]\n" (sem resposta), o cliente informa as compressões
+# aceitas, em ordem de preferência; o servidor escolhe a primeira que conhece e responde com
+# "OK <tamanho enviado> <compressão> <tamanho original>\n". Os checksums são sempre dos dados originais.
+
+class ChunkRequestHandler(socketserver.StreamRequestHandler):
+    """ Atende requisições de chunks enviando os bytes crus do arquivo, sem XML nem base64 """
+    # Conexões ociosas por mais tempo que isso são encerradas pelo servidor
+    timeout = DATA_TIMEOUT
+
+    def setup(self):
+        super().setup()
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.peer = self.client_address[0]
+        self.encoding = None
+
+    def handle(self):
+        while True:
+            try:
+                line = self.rfile.readline()
+            except (TimeoutError, ConnectionError):
+                break
+            if not line:
+                break
+            try:
+                command, chunk_name = line.decode("utf-8").rstrip("\n").split(" ", 1)
+            except ValueError:
+                self.wfile.write(b"ERR Requisicao invalida\n")
+                break
+            if command == "PEER":
+                self.peer = chunk_name
+                continue
+            if command == "ACCEPT":
+                self.encoding = choose_encoding(chunk_name.split(","))
+                continue
+            if command != "GET":
+                self.wfile.write(b"ERR Comando desconhecido\n")
+                break
+            self.send_chunk(chunk_name)
+
+    def send_chunk(self, chunk_name):
+        location = self.server.resolve(chunk_name)
+        if location is None:
+            self.wfile.write(f"ERR Chunk '{chunk_name}' não encontrado.\n".encode("utf-8"))
+            return
+        path, offset, length = location
+        limiter = self.server.limiter
+        try:
+            if limiter is None:
+                self.send_range(path, offset, length)
+                return
+            # Aguarda um slot de upload na fila justa entre os peers
+            with limiter.slot(self.peer):
+                sent = self.send_range(path, offset, length, limiter)
+                limiter.record(self.peer, sent)
+        except OSError as e:
+            print(f"Erro ao enviar chunk '{chunk_name}': {e}")
+            raise
+
+    def send_range(self, path, offset, length, limiter=None):
+        """ Envia o chunk, comprimido se negociado e vantajoso; retorna o número de bytes enviados """
+        cache = self.server.cache
+        # Dados que não comprimem bem seguem sem compressão, pelo sendfile
+        encoding = range_encoding(self.encoding, path, offset, length)
+        # Chunks populares são servidos da memória, já comprimidos
+        data = cache.payload((path, offset, length), encoding) if cache is not None else None
+        if data is None and encoding is None:
+            # Envio zero-copy do arquivo para o socket
+            with open(path, "rb") as f:
+                self.send_data(f"OK {length}\n", length, limiter,
+                               lambda start, size: self.connection.sendfile(f, offset + start, size))
+            return length
+        if data is None:
+            with open(path, "rb") as f:
+                f.seek(offset)
+                data = compress(encoding, f.read(length))
+        if encoding is None:
+            header = f"OK {len(data)}\n"
+        else:
+            header = f"OK {len(data)} {encoding} {length}\n"
+        view = memoryview(data)
+        self.send_data(header, len(data), limiter, lambda start, size: self.connection.sendall(view[start:start + size]))
+        return len(data)
+
+    def send_data(self, header, length, limiter, send):
+        """ Envia o cabeçalho e os `length` bytes do chunk com send(início, tamanho) """
+        self.wfile.write(header.encode("utf-8"))
+        self.wfile.flush()
+        if limiter is None or not limiter.limited:
+            send(0, length)
+            return
+        # Com limite de banda, o chunk é enviado em blocos liberados pelos token buckets
+        sent = 0
+        while sent < length:
+            block = min(SEND_BLOCK, length - sent)
+            limiter.throttle(self.peer, block)
+            send(sent, block)
+            sent += block
+
+class ChunkDataServer(socketserver.ThreadingTCPServer):
+    """
+    Servidor TCP do canal de dados do peer.
+    `resolve(chunk_name)` devolve (caminho, offset, tamanho) do chunk ou None se não existir.
+    `limiter` (upload.UploadLimiter), se informado, controla os slots e a banda de upload.
+    `cache` (cache.ChunkCache), se informado, mantém em memória os chunks mais pedidos.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host, resolve, port=0, limiter=None, cache=None):
+        super().__init__((host, port), ChunkRequestHandler)
+        self.resolve = resolve
+        self.limiter = limiter
+        self.cache = cache
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+# Prefixo dos nomes de chunk endereçados pelo conteúdo ("sha256:<checksum>"): qualquer peer que
+# possua um chunk com esse checksum, em qualquer arquivo, pode atendê-lo
+CONTENT_PREFIX = "sha256:"
+
+def content_chunk_name(checksum):
+    return f"{CONTENT_PREFIX}{checksum}"
+
+def resolve_chunk_file(chunk_name):
+    """ Localiza um chunk salvo como arquivo '{arquivo}.chunkN' no diretório do peer """
+    if os.path.basename(chunk_name) != chunk_name or ".chunk" not in chunk_name:
+        return None
+    if not os.path.isfile(chunk_name):
+        return None
+    return chunk_name, 0, os.path.getsize(chunk_name)
+
+# -------------------------
+# CLIENTE DO CANAL DE DADOS
+# -------------------------
+# Tempo (em segundos) até consultar de novo um peer que não informou o canal de dados
+DATA_ADDRESS_RETRY = 30
+
+# endereço XML-RPC -> ((host, porta) ou None, momento até o qual um None vale)
+data_addresses = {}
+data_addresses_lock = threading.Lock()
+
+def get_data_address(peer_address):
+    """
+    Descobre (host, porta) do canal de dados de um peer a partir do seu endereço XML-RPC.
+    Retorna None se o peer não oferecer o canal de dados. O endereço fica em cache; a falta
+    dele só vale por DATA_ADDRESS_RETRY segundos, para que uma falha passageira não seja definitiva.
+    """
+    with data_addresses_lock:
+        cached = data_addresses.get(peer_address)
+        if cached is not None and (cached[0] is not None or time.time() < cached[1]):
+            return cached[0]
+    try:
+        port = PooledServerProxy(peer_address).get_data_port()
+        address = (urlparse(peer_address).hostname, port)
+    except xmlrpc.client.Fault:
+        address = None
+    with data_addresses_lock:
+        data_addresses[peer_address] = (address, time.time() + DATA_ADDRESS_RETRY)
+    return address
+
+def parse_header(line):
+    """
+    Interpreta a linha de resposta do canal de dados e retorna
+    (tamanho enviado, compressão ou None, tamanho original).
+    """
+    line = line.decode("utf-8").rstrip("\n")
+    if line.startswith("OK "):
+        fields = line[3:].split(" ")
+        if len(fields) == 3:
+            return int(fields[0]), fields[1], int(fields[2])
+        return int(fields[0]), None, int(fields[0])
+    if line.startswith("ERR "):
+        raise IOError(line[4:])
+    raise IOError("Resposta inválida do canal de dados.")
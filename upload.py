@@ -0,0 +1,158 @@
+from collections import OrderedDict, deque
+import threading
+import time
+
+# Número padrão de chunks enviados simultaneamente pelo peer
+UPLOAD_SLOTS = 8
+# Tamanho dos blocos em que um chunk é enviado quando há limite de banda
+SEND_BLOCK = 64 * 1024
+
+class TokenBucket:
+    """
+    Limitador de taxa (token bucket): `rate` bytes por segundo, com rajadas de até `burst` bytes.
+    consume() pode deixar o saldo negativo (reserva); quem reservou espera o tempo necessário
+    para pagar a dívida, o que mantém a taxa média mesmo com várias threads.
+    """
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst if burst is not None else rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, amount):
+        """ Retira `amount` tokens, bloqueando até que estejam disponíveis """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= amount
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+
+class UploadSlots:
+    """
+    Slots de upload com fila justa: no máximo `slots` envios simultâneos; quando todos estão
+    ocupados, os pedidos esperam em uma fila por peer e cada slot liberado é entregue ao próximo
+    peer em rodízio (round-robin), para que um downloader com muitas requisições não monopolize
+    o seeder.
+    """
+    def __init__(self, slots=UPLOAD_SLOTS):
+        self.slots = slots
+        self.active = 0
+        # peer -> fila de pedidos em espera, na ordem do rodízio
+        self.waiting = OrderedDict()
+        self.lock = threading.Lock()
+
+    def acquire(self, peer):
+        with self.lock:
+            if self.active < self.slots and not self.waiting:
+                self.active += 1
+                return
+            ticket = threading.Event()
+            self.waiting.setdefault(peer, deque()).append(ticket)
+        # O slot é transferido diretamente por release()
+        ticket.wait()
+
+    def release(self):
+        with self.lock:
+            if not self.waiting:
+                self.active -= 1
+                return
+            peer, queue = next(iter(self.waiting.items()))
+            ticket = queue.popleft()
+            # O peer atendido vai para o fim do rodízio
+            del self.waiting[peer]
+            if queue:
+                self.waiting[peer] = queue
+        ticket.set()
+
+    def queue_depth(self):
+        with self.lock:
+            return {peer: len(queue) for peer, queue in self.waiting.items()}
+
+class UploadLimiter:
+    """
+    Controle do lado que serve os chunks: slots de upload com fila justa entre os peers,
+    limite global de banda (`rate`, bytes/s) e limite por peer (`peer_rate`, bytes/s).
+    Limites None desativam o controle de banda correspondente. Mantém estatísticas de fila
+    e de bytes enviados.
+    """
+    def __init__(self, slots=UPLOAD_SLOTS, rate=None, peer_rate=None):
+        self.slots = UploadSlots(slots)
+        self.bucket = TokenBucket(rate) if rate else None
+        self.peer_rate = peer_rate
+        self.peer_buckets = {}
+        self.bytes_served = 0
+        self.requests_served = 0
+        self.peer_bytes = {}
+        self.lock = threading.Lock()
+
+    @property
+    def limited(self):
+        return self.bucket is not None or self.peer_rate is not None
+
+    def slot(self, peer):
+        """ Ocupa um slot de upload durante um bloco `with` """
+        return UploadSlot(self, peer)
+
+    def throttle(self, peer, amount):
+        """ Aguarda a permissão dos limites de banda para enviar `amount` bytes a `peer` """
+        if self.bucket is not None:
+            self.bucket.consume(amount)
+        if self.peer_rate is not None:
+            with self.lock:
+                bucket = self.peer_buckets.get(peer)
+                if bucket is None:
+                    bucket = self.peer_buckets[peer] = TokenBucket(self.peer_rate)
+            bucket.consume(amount)
+
+    def record(self, peer, amount):
+        """ Contabiliza um chunk enviado """
+        with self.lock:
+            self.bytes_served += amount
+            self.requests_served += 1
+            self.peer_bytes[peer] = self.peer_bytes.get(peer, 0) + amount
+
+    def stats(self):
+        with self.lock:
+            stats = {
+                "slots": self.slots.slots,
+                "active": self.slots.active,
+                "bytes_served": self.bytes_served,
+                "requests_served": self.requests_served,
+                "peer_bytes": dict(self.peer_bytes),
+            }
+        stats["queue"] = self.slots.queue_depth()
+        stats["queue_depth"] = sum(stats["queue"].values())
+        return stats
+
+class UploadSlot:
+    def __init__(self, limiter, peer):
+        self.limiter = limiter
+        self.peer = peer
+
+    def __enter__(self):
+        self.limiter.slots.acquire(self.peer)
+        return self
+
+    def __exit__(self, *args):
+        self.limiter.slots.release()
+        return False
+
+def print_upload_stats(limiter, cache=None):
+    """ Exibe as estatísticas de upload do peer e, se informado, do cache de chunks """
+    stats = limiter.stats()
+    print(f"Slots de upload em uso: {stats['active']}/{stats['slots']}")
+    print(f"Pedidos na fila: {stats['queue_depth']}")
+    for peer, depth in stats["queue"].items():
+        print(f"  {peer}: {depth}")
+    print(f"Chunks enviados: {stats['requests_served']} ({stats['bytes_served']} bytes)")
+    for peer, amount in stats["peer_bytes"].items():
+        print(f"  {peer}: {amount} bytes")
+    if cache is not None:
+        stats = cache.stats()
+        print(f"Cache de chunks: {stats['entries']} chunks, {stats['bytes']}/{stats['max_bytes']} bytes")
+        print(f"  Acertos: {stats['hits']}, falhas: {stats['misses']} ({stats['hit_ratio']:.0%} de acertos)")
+        print(f"  Descartes: {stats['evictions']} ({stats['evicted_bytes']} bytes)")